@@ -1,21 +1,48 @@
-from fastapi import FastAPI, APIRouter, HTTPException, File, UploadFile
+from fastapi import FastAPI, APIRouter, HTTPException, File, UploadFile, Depends, Header, Request
+from fastapi.responses import PlainTextResponse, FileResponse, JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, UpdateOne, ReadPreference
+from bson import Binary, ObjectId
 import os
+import re
+import hmac
+import json
+import time
+import random
+import bisect
+import asyncio
 import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager, suppress
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import SimpleNamespace
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from emergentintegrations.llm.chat import LlmChat, UserMessage
-import pytesseract
-from pdf2image import convert_from_bytes
-from PIL import Image
 import io
-import cv2
-import numpy as np
+import zlib
+import base64
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # Profiling is optional; the middleware becomes a no-op
+    Profiler = None
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # Fall back to gzip-only compression
+    BrotliMiddleware = None
+
+STARTUP_STARTED_AT = time.perf_counter()
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -28,22 +55,495 @@ db = client[os.environ['DB_NAME']]
 # Gemini API key
 GEMINI_API_KEY = os.environ['GEMINI_API_KEY']
 
+# Diagnosis loop settings
+DIAGNOSIS_CONFIDENCE_THRESHOLD = float(os.environ.get('DIAGNOSIS_CONFIDENCE_THRESHOLD', '0.85'))
+MAX_DIAGNOSIS_TURNS = int(os.environ.get('MAX_DIAGNOSIS_TURNS', '10'))
+
+# Session lifecycle: idle incomplete sessions expire, completed ones move to a compact archive
+SESSION_IDLE_TTL_SECONDS = int(os.environ.get('SESSION_IDLE_TTL_SECONDS', str(24 * 3600)))
+SESSION_ARCHIVE_AFTER_SECONDS = int(os.environ.get('SESSION_ARCHIVE_AFTER_SECONDS', '3600'))
+SESSION_ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('SESSION_ARCHIVE_INTERVAL_SECONDS', '300'))
+SESSION_ARCHIVE_BATCH_SIZE = int(os.environ.get('SESSION_ARCHIVE_BATCH_SIZE', '500'))
+SESSION_COMPACTOR_ENABLED = os.environ.get('SESSION_COMPACTOR_ENABLED', 'true').lower() == 'true'
+
+# Document storage: large text fields are zlib-compressed, and stored out of line in chunks above the limit
+DOCUMENT_INLINE_LIMIT_BYTES = int(os.environ.get('DOCUMENT_INLINE_LIMIT_BYTES', str(64 * 1024)))
+DOCUMENT_BLOB_CHUNK_BYTES = int(os.environ.get('DOCUMENT_BLOB_CHUNK_BYTES', str(255 * 1024)))
+DOCUMENT_COMPRESSION_LEVEL = int(os.environ.get('DOCUMENT_COMPRESSION_LEVEL', '6'))
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MINIMUM_BYTES = int(os.environ.get('COMPRESSION_MINIMUM_BYTES', '1024'))
+DOCUMENT_SUMMARY_CHARS = int(os.environ.get('DOCUMENT_SUMMARY_CHARS', '600'))
+
+# Documents checked per pass when indexing uploads that predate the search index
+SEARCH_BACKFILL_BATCH_SIZE = int(os.environ.get('SEARCH_BACKFILL_BATCH_SIZE', '100'))
+
+# Bulk export: rows per server-side cursor batch (bounds memory per export stream)
+EXPORT_DEFAULT_BATCH_SIZE = int(os.environ.get('EXPORT_DEFAULT_BATCH_SIZE', '500'))
+EXPORT_MAX_BATCH_SIZE = int(os.environ.get('EXPORT_MAX_BATCH_SIZE', '5000'))
+# A batch is also flushed once its serialized rows reach this size, so decompressed document text can't pile up
+EXPORT_MAX_BATCH_BYTES = int(os.environ.get('EXPORT_MAX_BATCH_BYTES', str(4 * 1024 * 1024)))
+
+# Batched suggestions: knowledge-base misses per LLM prompt, and prompts in flight per request
+BATCH_SUGGESTION_MAX_CONDITIONS = int(os.environ.get('BATCH_SUGGESTION_MAX_CONDITIONS', '25'))
+BATCH_SUGGESTION_GROUP_SIZE = int(os.environ.get('BATCH_SUGGESTION_GROUP_SIZE', '8'))
+BATCH_SUGGESTION_CONCURRENCY = int(os.environ.get('BATCH_SUGGESTION_CONCURRENCY', '3'))
+
+# Request deadlines (overridable per request with X-Request-Timeout) and client-disconnect polling
+DEFAULT_REQUEST_TIMEOUT_SECONDS = float(os.environ.get('DEFAULT_REQUEST_TIMEOUT_SECONDS', '120'))
+MAX_REQUEST_TIMEOUT_SECONDS = float(os.environ.get('MAX_REQUEST_TIMEOUT_SECONDS', '300'))
+DISCONNECT_POLL_SECONDS = float(os.environ.get('DISCONNECT_POLL_SECONDS', '0.5'))
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', str(os.cpu_count() or 2)))
+
+# Priority scheduling of OCR workers and LLM calls: "class=value" lists; reserved slots are held back for their class
+SCHEDULER_WEIGHTS = os.environ.get('SCHEDULER_WEIGHTS', 'interactive=4,bulk=1')
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '64'))
+LLM_RESERVED_SLOTS = os.environ.get('LLM_RESERVED_SLOTS', 'interactive=8')
+OCR_RESERVED_SLOTS = os.environ.get('OCR_RESERVED_SLOTS', '')
+
+# Startup warmup settings; chat-only workers can skip loading the OCR stack
+WARMUP_OCR = os.environ.get('WARMUP_OCR', 'true').lower() == 'true'
+WARMUP_LLM_PING = os.environ.get('WARMUP_LLM_PING', 'false').lower() == 'true'
+# Required warmup steps (Mongo, knowledge base) are retried with exponential backoff until they succeed
+WARMUP_RETRY_INITIAL_SECONDS = float(os.environ.get('WARMUP_RETRY_INITIAL_SECONDS', '1'))
+WARMUP_RETRY_MAX_SECONDS = float(os.environ.get('WARMUP_RETRY_MAX_SECONDS', '30'))
+
+# Admin endpoints and on-demand profiling are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Request profiling settings
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.001'))
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles')))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '50'))
+
+# Instrumentation (Prometheus text format, kept dependency-free and cheap on the hot path)
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS_REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for key, value in list(self._values.items()):
+            lines.append(f"{self.name}{self._format_labels(key)} {value}")
+        return lines
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    metric_type = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (plus +Inf), running sum, total count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def value(self, **labels) -> float:
+        state = self._values.get(self._key(labels))
+        return state[1] / state[2] if state and state[2] else 0.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for key, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = self._format_labels(key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+METRICS_REGISTRY: List[Metric] = []
+
+HTTP_REQUEST_LATENCY = Histogram("medi_http_request_duration_seconds", "HTTP request latency by endpoint", ("method", "endpoint", "status"))
+HTTP_IN_FLIGHT = Gauge("medi_http_requests_in_flight", "HTTP requests currently being served")
+STAGE_LATENCY = Histogram("medi_stage_duration_seconds", "Time spent in each processing stage", ("stage", "operation"))
+LLM_IN_FLIGHT = Gauge("medi_llm_calls_in_flight", "LLM calls currently awaiting a response")
+LLM_TOKENS = Counter("medi_llm_tokens_total", "Estimated LLM tokens (4 characters per token)", ("purpose", "direction"))
+LLM_ERRORS = Counter("medi_llm_errors_total", "LLM calls that raised an error", ("purpose",))
+OCR_IN_FLIGHT = Gauge("medi_ocr_jobs_in_flight", "Documents currently being rasterized or OCR'd")
+KNOWLEDGE_BASE_LOOKUPS = Counter("medi_knowledge_base_lookups_total", "Knowledge base lookups answered locally (hit) or sent to the LLM (miss)", ("endpoint", "result"))
+DIAGNOSIS_SESSIONS_COMPLETED = Counter("medi_diagnosis_sessions_completed_total", "Diagnosis sessions that reached a final diagnosis")
+DIAGNOSIS_LLM_CALLS = Counter("medi_diagnosis_llm_calls_total", "LLM calls made by diagnosis sessions that completed")
+STARTUP_DURATION = Gauge("medi_startup_duration_seconds", "Seconds from module import until warmup finished")
+WARMUP_STEP_DURATION = Gauge("medi_warmup_step_duration_seconds", "Duration of each startup warmup step", ("step", "status"))
+READY = Gauge("medi_ready", "1 once startup warmup has completed")
+DOCUMENT_BYTES = Counter("medi_document_bytes_total", "Document content bytes before (raw) and after (stored) compression", ("field", "kind"))
+EXPORT_ROWS = Counter("medi_export_rows_total", "Rows streamed by admin export endpoints", ("dataset",))
+CANCELLED_REQUESTS = Counter("medi_cancelled_requests_total", "Requests abandoned because the client disconnected or the deadline passed", ("endpoint", "reason"))
+CANCELLED_WORK = Counter("medi_cancelled_work_total", "Units of work skipped by cancellation", ("kind",))
+CPU_SECONDS_SAVED = Counter("medi_cancelled_cpu_seconds_saved_total", "Estimated OCR CPU-seconds not spent thanks to cancellation")
+SCHEDULER_QUEUE_TIME = Histogram("medi_scheduler_queue_seconds", "Time spent waiting for an OCR worker or LLM slot", ("resource", "priority"))
+SCHEDULER_QUEUED = Gauge("medi_scheduler_queued", "Work waiting for an OCR worker or LLM slot", ("resource", "priority"))
+SCHEDULER_ACTIVE = Gauge("medi_scheduler_active", "OCR workers or LLM slots in use", ("resource", "priority"))
+SESSIONS_ARCHIVED = Counter("medi_sessions_archived_total", "Completed diagnosis sessions moved to the archive collection")
+
+@contextmanager
+def track_stage(stage: str, operation: str):
+    """Time a processing stage (rasterize, ocr, llm, mongo) into STAGE_LATENCY"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage=stage, operation=operation)
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS_REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-endpoint latency without BaseHTTPMiddleware overhead"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status = {"code": 500}
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+        
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # Use the route template so path parameters don't explode label cardinality
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                method=scope["method"], endpoint=endpoint, status=status["code"]
+            )
+
+# Cancellation and deadlines
+class DeadlineExceeded(Exception):
+    pass
+
+# Monotonic deadline of the request being served; copied into tasks and threads it spawns
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def remaining_time() -> Optional[float]:
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def check_deadline(kind: str):
+    """Raise DeadlineExceeded before starting a unit of work the client will no longer wait for"""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        CANCELLED_WORK.inc(kind=kind)
+        raise DeadlineExceeded(f"Deadline exceeded before {kind}")
+
+async def run_cancellable(request: Request, work, endpoint: str, priority: str = "interactive"):
+    """Run an endpoint's work under its deadline, cancelling it if the client disconnects.
+
+    Cancellation propagates into in-flight LLM calls and pending OCR pages. Work whose writes
+    span several collections shields them once started (see persist_medical_document), so a
+    late disconnect can't leave them half-applied.
+    """
+    try:
+        timeout = float(request.headers.get("x-request-timeout", DEFAULT_REQUEST_TIMEOUT_SECONDS))
+    except ValueError:
+        timeout = DEFAULT_REQUEST_TIMEOUT_SECONDS
+    deadline = time.monotonic() + min(max(timeout, 0.0), MAX_REQUEST_TIMEOUT_SECONDS)
+    
+    token = request_deadline.set(deadline)
+    priority_token = request_priority.set(priority)
+    try:
+        task = asyncio.ensure_future(work)
+    finally:
+        request_priority.reset(priority_token)
+        request_deadline.reset(token)
+    
+    reason = None
+    try:
+        while reason is None:
+            done, _ = await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_SECONDS, max(deadline - time.monotonic(), 0.0)))
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                reason = "client_disconnect"
+            elif time.monotonic() >= deadline:
+                reason = "deadline"
+    except DeadlineExceeded:
+        reason = "deadline"
+    finally:
+        if not task.done():
+            task.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await task
+    
+    CANCELLED_REQUESTS.inc(endpoint=endpoint, reason=reason)
+    if reason == "deadline":
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    # Nobody is listening any more; 499 is what the access log should show
+    raise HTTPException(status_code=499, detail="Client closed request")
+
+# Priority scheduling
+# Priority class of the request being served; work started outside an endpoint counts as interactive
+request_priority: ContextVar[str] = ContextVar("request_priority", default="interactive")
+
+def parse_class_settings(value: str) -> dict:
+    settings = {}
+    for item in value.split(","):
+        name, _, amount = item.partition("=")
+        if name.strip() and amount.strip():
+            settings[name.strip()] = float(amount)
+    return settings
+
+class PriorityScheduler:
+    """Weighted fair queuing over a fixed number of slots, with per-class reserved capacity.
+
+    Each waiter gets a virtual finish tag of 1/weight past its class's previous tag, and a free
+    slot goes to the smallest tag among classes allowed to take it. A class may only take a slot
+    if enough remain for every other class's unused reservation, so a bulk backlog can never
+    occupy the slots interactive work is guaranteed.
+    """
+
+    def __init__(self, resource: str, capacity: int, weights: dict, reserved: dict):
+        self.resource = resource
+        self.capacity = max(capacity, 1)
+        self.weights = {name: max(weight, 0.01) for name, weight in weights.items()} or {"interactive": 1.0}
+        # Capped below capacity so no class's reservation can shut every other class out
+        self.reserved = {name: min(int(reserved.get(name, 0)), self.capacity - 1) for name in self.weights}
+        self.default_class = "interactive" if "interactive" in self.weights else next(iter(self.weights))
+        self.active = {name: 0 for name in self.weights}
+        self.queues = {name: deque() for name in self.weights}
+        self.finish_tags = {name: 0.0 for name in self.weights}
+        self.virtual_time = 0.0
+
+    def _can_admit(self, priority: str) -> bool:
+        free = self.capacity - sum(self.active.values())
+        held = sum(max(self.reserved[name] - self.active[name], 0) for name in self.weights if name != priority)
+        return free - held >= 1
+
+    def _dispatch(self):
+        while True:
+            best = None
+            for name, queue in self.queues.items():
+                while queue and queue[0][1].done():
+                    queue.popleft()  # Waiter was cancelled or timed out
+                if queue and self._can_admit(name) and (best is None or queue[0][0] < self.queues[best][0][0]):
+                    best = name
+            if best is None:
+                return
+            tag, waiter = self.queues[best].popleft()
+            self.virtual_time = tag
+            self.active[best] += 1
+            SCHEDULER_ACTIVE.inc(resource=self.resource, priority=best)
+            waiter.set_result(None)
+
+    def _release(self, priority: str):
+        self.active[priority] -= 1
+        SCHEDULER_ACTIVE.dec(resource=self.resource, priority=priority)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one slot for the current request's priority class, waiting no longer than its deadline"""
+        priority = request_priority.get()
+        if priority not in self.weights:
+            priority = self.default_class
+        tag = max(self.virtual_time, self.finish_tags[priority]) + 1.0 / self.weights[priority]
+        self.finish_tags[priority] = tag
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues[priority].append((tag, waiter))
+        start = time.perf_counter()
+        self._dispatch()
+        
+        SCHEDULER_QUEUED.inc(resource=self.resource, priority=priority)
+        try:
+            await asyncio.wait_for(waiter, remaining_time())
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                self._release(priority)  # Granted just as the wait was abandoned
+            if isinstance(e, asyncio.TimeoutError):
+                CANCELLED_WORK.inc(kind=f"{self.resource}_queue")
+                raise DeadlineExceeded(f"Deadline exceeded waiting for {self.resource}")
+            raise
+        finally:
+            SCHEDULER_QUEUED.dec(resource=self.resource, priority=priority)
+            SCHEDULER_QUEUE_TIME.observe(time.perf_counter() - start, resource=self.resource, priority=priority)
+        
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+# Request profiling
+PROFILE_HEADER = b"x-profile-request"
+PROFILE_NAME_PATTERN = re.compile(r"^[\w.-]+\.speedscope\.json$")
+
+def is_admin_token(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def write_profile(name: str, content: str):
+    """Write a profile and drop the oldest ones beyond PROFILE_KEEP"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    (PROFILE_DIR / name).write_text(content)
+    profiles = sorted(PROFILE_DIR.glob("*.speedscope.json"), key=lambda path: path.stat().st_mtime)
+    for stale in profiles[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else profiles:
+        stale.unlink(missing_ok=True)
+
+def list_profiles() -> List[dict]:
+    if not PROFILE_DIR.exists():
+        return []
+    profiles = sorted(PROFILE_DIR.glob("*.speedscope.json"), key=lambda path: path.stat().st_mtime, reverse=True)
+    return [
+        {
+            "name": path.name,
+            "size_bytes": path.stat().st_size,
+            "created_at": datetime.utcfromtimestamp(path.stat().st_mtime)
+        }
+        for path in profiles
+    ]
+
+class ProfilingMiddleware:
+    """Profile a random sample of requests, or one flagged with X-Profile-Request: <admin token>.
+
+    Uses pyinstrument's async-aware sampling profiler and writes speedscope (flame graph) JSON.
+    Only one request per worker is profiled at a time to keep the overhead bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.active = False
+
+    def should_profile(self, scope) -> bool:
+        if Profiler is None or self.active:
+            return False
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return is_admin_token(value.decode("latin-1"))
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        
+        self.active = True
+        profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.stop()
+            self.active = False
+            slug = re.sub(r"[^\w]+", "-", scope["path"]).strip("-") or "root"
+            name = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{scope['method'].lower()}-{slug}.speedscope.json"
+            try:
+                content = profiler.output(renderer=SpeedscopeRenderer())
+                await asyncio.to_thread(write_profile, name, content)
+            except Exception as e:
+                logging.error(f"Error writing profile {name}: {str(e)}")
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 # Create the main app without a prefix
-app = FastAPI(title="Enhanced Medical AI Assistant", description="Comprehensive AI-powered medical diagnosis, medicine suggestions, and exercise recommendations")
+app = FastAPI(
+    title="Enhanced Medical AI Assistant",
+    description="Comprehensive AI-powered medical diagnosis, medicine suggestions, and exercise recommendations"
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Define Models
+class RankedCondition(BaseModel):
+    name: str
+    probability: float = Field(ge=0.0, le=1.0)
+
+class DiagnosisTurn(BaseModel):
+    """Structured reply the LLM returns on every diagnosis turn"""
+    type: Literal["question", "diagnosis"]
+    question: Optional[str] = None
+    diagnosis: Optional[str] = None
+    conditions: List[RankedCondition] = []
+    structured: bool = True  # False when the reply wasn't valid JSON and was taken as a plain question
+
 class DiagnosisSession(BaseModel):
     session_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_responses: List[str] = []
     current_question: Optional[str] = None
     confidence_score: float = 0.0
     potential_conditions: List[str] = []
+    ranked_conditions: List[RankedCondition] = []
+    llm_calls: int = 0
     final_diagnosis: Optional[str] = None
     recommendations: Optional[dict] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+    last_activity: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: Optional[datetime] = None  # TTL-indexed; cleared once the session completes
+    completed_at: Optional[datetime] = None
+    archived: bool = False
 
 class UserResponse(BaseModel):
     session_id: str
@@ -54,6 +554,7 @@ class DiagnosisResult(BaseModel):
     question: Optional[str] = None
     confidence_score: float
     potential_conditions: List[str]
+    ranked_conditions: List[RankedCondition] = []
     final_diagnosis: Optional[str] = None
     recommendations: Optional[dict] = None
     is_complete: bool = False
@@ -64,12 +565,26 @@ class MedicineRequest(BaseModel):
 class ExerciseRequest(BaseModel):
     condition: str
 
+class BatchSuggestionRequest(BaseModel):
+    conditions: List[str]
+    include: List[Literal["medicines", "exercises"]] = ["medicines", "exercises"]
+
 class DocumentAnalysis(BaseModel):
+    document_id: Optional[str] = None
     filename: str
     extracted_text: str
     analysis: dict
     recommendations: Optional[dict] = None
 
+class DocumentSummary(BaseModel):
+    """Lean upload response: the full text is fetched separately from text_url"""
+    document_id: str
+    filename: str
+    summary: str
+    text_size: int
+    text_url: str
+    recommendations: Optional[dict] = None
+
 # Enhanced Medical Knowledge Base
 MEDICAL_CONDITIONS = [
     {
@@ -164,40 +679,169 @@ MEDICAL_CONDITIONS = [
     }
 ]
 
+# Lower-cased lookup tables built once from MEDICAL_CONDITIONS
+KNOWLEDGE_BASE_INDEX: List[tuple] = []
+CONDITIONS_BY_NAME: dict = {}
+# Condition and medicine names boosted in document search: alias -> (kind, display name)
+SEARCH_BOOST = {"pattern": None, "terms": {}}
+
+def compile_knowledge_base():
+    """Precompute case-folded names and symptoms so lookups don't re-lower the catalog per request"""
+    KNOWLEDGE_BASE_INDEX[:] = [
+        (condition["name"].lower(), [symptom.lower() for symptom in condition["symptoms"]], condition)
+        for condition in MEDICAL_CONDITIONS
+    ]
+    CONDITIONS_BY_NAME.clear()
+    CONDITIONS_BY_NAME.update({condition["name"]: condition for condition in MEDICAL_CONDITIONS})
+    
+    terms = {}
+    for condition in MEDICAL_CONDITIONS:
+        # "Acid Reflux (GERD)" is matched as both "acid reflux" and "gerd"
+        name = condition["name"]
+        for alias in re.split(r"\s*[()]\s*", name.lower()):
+            if alias:
+                terms[alias] = ("conditions", name)
+        for medicine in condition["medicines"]:
+            # "Metformin 500mg (twice daily)" -> "Metformin"
+            base = re.split(r"\s+\d|\s*\(", medicine)[0].strip()
+            terms.setdefault(base.lower(), ("medicines", base))
+    SEARCH_BOOST["terms"] = terms
+    SEARCH_BOOST["pattern"] = re.compile(
+        r"\b(" + "|".join(re.escape(alias) for alias in sorted(terms, key=len, reverse=True)) + r")\b"
+    )
+
+def get_knowledge_base_index() -> List[tuple]:
+    if not KNOWLEDGE_BASE_INDEX:
+        compile_knowledge_base()
+    return KNOWLEDGE_BASE_INDEX
+
 # Document Processing Class
 class DocumentProcessor:
+    _modules = None
+
+    @classmethod
+    def modules(cls) -> SimpleNamespace:
+        """Import the OCR and imaging stack on first use so chat-only workers never load it"""
+        if cls._modules is None:
+            import pytesseract
+            from pdf2image import convert_from_bytes
+            from PIL import Image
+            cls._modules = SimpleNamespace(pytesseract=pytesseract, convert_from_bytes=convert_from_bytes, Image=Image)
+        return cls._modules
+
+    @classmethod
+    def warmup(cls) -> str:
+        """Load the OCR stack and check that the tesseract binary responds"""
+        return str(cls.modules().pytesseract.get_tesseract_version())
+
     @staticmethod
-    def extract_text_from_image(image_bytes: bytes) -> str:
+    def ocr_page(image) -> str:
+        """OCR a single PIL image (runs on the OCR executor)"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # Use pytesseract to extract text
+        with track_stage("ocr", "page"):
+            text = DocumentProcessor.modules().pytesseract.image_to_string(image, lang='eng')
+        return text.strip()
+    
+    @staticmethod
+    def rasterize_pdf(pdf_bytes: bytes) -> list:
+        with track_stage("rasterize", "pdf"):
+            return DocumentProcessor.modules().convert_from_bytes(pdf_bytes)
+    
+    @staticmethod
+    async def ocr_pages(images: list) -> List[str]:
+        """OCR pages in parallel on the OCR executor.
+
+        If the request is cancelled, pages that haven't started are dropped from the queue;
+        pages already running finish in their thread but their results are discarded.
+        """
+        check_deadline("ocr_page")
+        started = []
+        loop = asyncio.get_running_loop()
+        
+        async def run_page(image):
+            async with OCR_SCHEDULER.slot():
+                started.append(True)
+                return await loop.run_in_executor(OCR_EXECUTOR, DocumentProcessor.ocr_page, image)
+        
+        pages = [asyncio.ensure_future(run_page(image)) for image in images]
+        try:
+            return await asyncio.gather(*pages)
+        except (asyncio.CancelledError, DeadlineExceeded):
+            for page in pages:
+                page.cancel()
+            skipped = len(images) - len(started)
+            if skipped:
+                CANCELLED_WORK.inc(skipped, kind="ocr_page")
+                CPU_SECONDS_SAVED.inc(skipped * STAGE_LATENCY.value(stage="ocr", operation="page"))
+            raise
+    
+    @staticmethod
+    async def extract_text_from_image(image_bytes: bytes) -> str:
         """Extract text from image using OCR"""
         try:
-            image = Image.open(io.BytesIO(image_bytes))
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Use pytesseract to extract text
-            text = pytesseract.image_to_string(image, lang='eng')
-            return text.strip()
+            image = DocumentProcessor.modules().Image.open(io.BytesIO(image_bytes))
+            return (await DocumentProcessor.ocr_pages([image]))[0]
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
     
     @staticmethod
-    def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+    async def extract_text_from_pdf(pdf_bytes: bytes) -> str:
         """Extract text from PDF using OCR"""
         try:
-            images = convert_from_bytes(pdf_bytes)
-            extracted_text = ""
-            for i, image in enumerate(images):
-                img_byte_arr = io.BytesIO()
-                image.save(img_byte_arr, format='PNG')
-                img_byte_arr = img_byte_arr.getvalue()
-                
-                page_text = DocumentProcessor.extract_text_from_image(img_byte_arr)
-                extracted_text += f"--- Page {i+1} ---\n{page_text}\n\n"
-            
+            check_deadline("rasterize")
+            async with OCR_SCHEDULER.slot():
+                images = await asyncio.get_running_loop().run_in_executor(OCR_EXECUTOR, DocumentProcessor.rasterize_pdf, pdf_bytes)
+            page_texts = await DocumentProcessor.ocr_pages(images)
+            extracted_text = "".join(f"--- Page {i+1} ---\n{page_text}\n\n" for i, page_text in enumerate(page_texts))
             return extracted_text.strip()
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
+# Tesseract runs as a subprocess, so threads give real parallelism across pages.
+# The scheduler hands out exactly as many slots as there are workers, so the executor's own queue stays empty
+OCR_EXECUTOR = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+OCR_SCHEDULER = PriorityScheduler("ocr", OCR_WORKERS, parse_class_settings(SCHEDULER_WEIGHTS), parse_class_settings(OCR_RESERVED_SLOTS))
+LLM_SCHEDULER = PriorityScheduler("llm", LLM_CONCURRENCY, parse_class_settings(SCHEDULER_WEIGHTS), parse_class_settings(LLM_RESERVED_SLOTS))
+
+async def send_llm_message(system_message: str, text: str, purpose: str, session_id: Optional[str] = None, max_tokens: Optional[int] = None) -> str:
+    """Send a single message to Gemini, recording latency, token and error metrics"""
+    chat = LlmChat(
+        api_key=GEMINI_API_KEY,
+        session_id=session_id or str(uuid.uuid4()),
+        system_message=system_message
+    ).with_model("gemini", "gemini-2.0-flash")
+    if max_tokens:
+        chat = chat.with_max_tokens(max_tokens)
+    
+    check_deadline("llm_call")
+    async with LLM_SCHEDULER.slot():
+        LLM_IN_FLIGHT.inc()
+        try:
+            with track_stage("llm", purpose):
+                response = await asyncio.wait_for(chat.send_message(UserMessage(text=text)), remaining_time())
+        except asyncio.TimeoutError:
+            CANCELLED_WORK.inc(kind="llm_call")
+            raise DeadlineExceeded(f"Deadline exceeded during {purpose} LLM call")
+        except asyncio.CancelledError:
+            CANCELLED_WORK.inc(kind="llm_call")
+            raise
+        except Exception:
+            LLM_ERRORS.inc(purpose=purpose)
+            raise
+        finally:
+            LLM_IN_FLIGHT.dec()
+    
+    LLM_TOKENS.inc(estimate_tokens(system_message) + estimate_tokens(text), purpose=purpose, direction="prompt")
+    LLM_TOKENS.inc(estimate_tokens(response), purpose=purpose, direction="completion")
+    return response
+
 def get_medical_system_prompt():
     return """You are an expert medical AI assistant similar to Akinator, but for medical diagnosis. Your role is to:
 
@@ -219,6 +863,12 @@ Guidelines:
 - Build towards a confident diagnosis
 - If unsure, ask clarifying questions
 
+Response format:
+Reply with a single JSON object and nothing else:
+{"type": "question" or "diagnosis", "question": "next yes/no question", "diagnosis": "short diagnosis summary", "conditions": [{"name": "condition name", "probability": 0.0 to 1.0}]}
+- "conditions" ranks the most likely conditions, highest probability first
+- Use "diagnosis" only when the top condition is clearly the most likely one; otherwise use "question"
+
 Current conversation context: The user is experiencing health issues and you need to diagnose their condition through strategic questioning."""
 
 async def get_gemini_response(session_id: str, user_input: str, conversation_history: List[str]) -> str:
@@ -226,64 +876,502 @@ async def get_gemini_response(session_id: str, user_input: str, conversation_his
     try:
         context = "\n".join(conversation_history) if conversation_history else "Starting new medical consultation."
         
-        chat = LlmChat(
-            api_key=GEMINI_API_KEY,
+        response = await send_llm_message(
+            get_medical_system_prompt(),
+            f"Patient response: {user_input}\n\nConversation so far:\n{context}\n\nPlease ask the next diagnostic question or provide diagnosis if confident. Reply in the JSON format described above.",
+            purpose="diagnosis",
             session_id=session_id,
-            system_message=get_medical_system_prompt()
-        ).with_model("gemini", "gemini-2.0-flash").with_max_tokens(1000)
-        
-        message = UserMessage(
-            text=f"Patient response: {user_input}\n\nConversation so far:\n{context}\n\nPlease ask the next diagnostic question or provide diagnosis if confident."
+            max_tokens=1000
         )
-        
-        response = await chat.send_message(message)
         return response
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
+        # Surface the failure instead of letting an apology be stored and shown as the next question
         logging.error(f"Gemini API error: {str(e)}")
-        return "I apologize, but I'm having trouble processing your request. Please try again."
+        raise HTTPException(status_code=502, detail="The diagnosis service is temporarily unavailable. Please try again.")
+
+def extract_json_object(text: str) -> dict:
+    """Pull the outermost JSON object out of an LLM reply (which may wrap it in prose or code fences)"""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        raise ValueError("No JSON object in reply")
+    data = json.loads(match.group(0))
+    if not isinstance(data, dict):
+        raise ValueError("Reply is not a JSON object")
+    return data
+
+def parse_diagnosis_turn(text: str) -> DiagnosisTurn:
+    """Validate the structured diagnosis reply, falling back to treating it as a plain question"""
+    try:
+        data = extract_json_object(text)
+    except ValueError:
+        data = None
+    if data is not None:
+        try:
+            conditions = []
+            for item in data.get("conditions") or []:
+                probability = float(item.get("probability", 0.0))
+                if probability > 1.0:
+                    # Some replies use percentages instead of fractions
+                    probability /= 100.0
+                conditions.append(RankedCondition(
+                    name=str(item["name"]),
+                    probability=min(max(probability, 0.0), 1.0)
+                ))
+            conditions.sort(key=lambda c: c.probability, reverse=True)
+            return DiagnosisTurn(
+                type=data.get("type"),
+                question=data.get("question") or None,
+                diagnosis=data.get("diagnosis") or None,
+                conditions=conditions
+            )
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.warning(f"Invalid structured diagnosis reply: {str(e)}")
+    return DiagnosisTurn(type="question", question=text.strip() or None, structured=False)
+
+async def get_diagnosis_turn(session_id: str, user_input: str, conversation_history: List[str]) -> DiagnosisTurn:
+    """Get the next structured diagnosis turn from Gemini"""
+    response = await get_gemini_response(session_id, user_input, conversation_history)
+    return parse_diagnosis_turn(response)
+
+def record_completed_session(llm_calls: int):
+    DIAGNOSIS_SESSIONS_COMPLETED.inc()
+    DIAGNOSIS_LLM_CALLS.inc(llm_calls)
 
 async def analyze_medical_document(text: str) -> dict:
     """Analyze medical document text using Gemini"""
     try:
-        chat = LlmChat(
-            api_key=GEMINI_API_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message="You are a medical document analysis expert. Analyze medical reports and extract key information."
-        ).with_model("gemini", "gemini-2.0-flash").with_max_tokens(1500)
-        
-        message = UserMessage(
-            text=f"Analyze this medical document and extract: 1) Diagnosed conditions 2) Mentioned symptoms 3) Prescribed medicines 4) Recommended tests 5) Key medical values. Document text: {text}"
+        response = await send_llm_message(
+            "You are a medical document analysis expert. Analyze medical reports and extract key information.",
+            f"Analyze this medical document and extract: 1) Diagnosed conditions 2) Mentioned symptoms 3) Prescribed medicines 4) Recommended tests 5) Key medical values. Document text: {text}",
+            purpose="document_analysis",
+            max_tokens=1500
         )
-        
-        response = await chat.send_message(message)
         return {"analysis": response}
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return {"analysis": f"Error analyzing document: {str(e)}"}
 
+# Document storage
+DOCUMENT_CONTENT_FIELDS = ("extracted_text", "analysis", "recommendations")
+
+def document_projection(include: tuple = ()) -> dict:
+    """Exclude content payloads (and pre-compression inline fields) that weren't asked for"""
+    projection = {"_id": 0}
+    for field in DOCUMENT_CONTENT_FIELDS:
+        if field not in include:
+            projection[f"content.{field}.data"] = 0
+            projection[field] = 0
+    return projection
+
+def pack_document_field(document_id: str, field: str, value) -> tuple:
+    """Compress a content field; returns its descriptor and any out-of-line blob chunks"""
+    # Text is stored as plain UTF-8 so byte ranges can be served by streaming decompression
+    if isinstance(value, str):
+        raw, encoding = value.encode("utf-8"), "zlib+utf8"
+    else:
+        raw, encoding = json.dumps(value).encode("utf-8"), "zlib+json"
+    compressed = zlib.compress(raw, DOCUMENT_COMPRESSION_LEVEL)
+    descriptor = {"encoding": encoding, "size": len(raw), "compressed_size": len(compressed)}
+    DOCUMENT_BYTES.inc(len(raw), field=field, kind="raw")
+    DOCUMENT_BYTES.inc(len(compressed), field=field, kind="stored")
+    
+    if len(compressed) <= DOCUMENT_INLINE_LIMIT_BYTES:
+        descriptor.update(location="inline", data=Binary(compressed))
+        return descriptor, []
+    
+    chunks = [
+        {"document_id": document_id, "field": field, "n": n, "data": Binary(compressed[offset:offset + DOCUMENT_BLOB_CHUNK_BYTES])}
+        for n, offset in enumerate(range(0, len(compressed), DOCUMENT_BLOB_CHUNK_BYTES))
+    ]
+    descriptor.update(location="blob", chunks=len(chunks))
+    return descriptor, chunks
+
+async def store_medical_document(metadata: dict, content: dict) -> dict:
+    """Insert a document's metadata with compressed content, writing blob chunks first"""
+    document = {**metadata, "content": {}}
+    blob_chunks = []
+    for field, value in content.items():
+        document["content"][field], chunks = await asyncio.to_thread(pack_document_field, metadata["document_id"], field, value)
+        blob_chunks.extend(chunks)
+    
+    # Chunks go first so metadata never points at a blob that doesn't exist yet
+    if blob_chunks:
+        with track_stage("mongo", "document_blobs.insert_many"):
+            await db.document_blobs.insert_many(blob_chunks)
+    with track_stage("mongo", "medical_documents.insert_one"):
+        await db.medical_documents.insert_one(document)
+    return document
+
+async def iter_document_field_bytes(document: dict, field: str):
+    """Yield the decompressed bytes of a content field, one stored chunk at a time"""
+    descriptor = document["content"][field]
+    if descriptor["location"] == "inline":
+        yield zlib.decompress(bytes(descriptor["data"]))
+        return
+    
+    decompressor = zlib.decompressobj()
+    cursor = db.document_blobs.find(
+        {"document_id": document["document_id"], "field": field}, {"_id": 0, "data": 1}
+    ).sort("n", 1)
+    async for chunk in cursor:
+        yield decompressor.decompress(bytes(chunk["data"]))
+    yield decompressor.flush()
+
+async def load_document_field(document: dict, field: str):
+    """Decompress one content field of a document fetched with its data included"""
+    descriptor = document.get("content", {}).get(field)
+    if descriptor is None:
+        # Documents stored before compression keep their fields inline and uncompressed
+        return document.get(field)
+    
+    if descriptor["location"] == "inline":
+        compressed = bytes(descriptor["data"])
+    else:
+        with track_stage("mongo", "document_blobs.find"):
+            chunks = await db.document_blobs.find(
+                {"document_id": document["document_id"], "field": field}, {"_id": 0, "data": 1}
+            ).sort("n", 1).to_list(None)
+        compressed = b"".join(bytes(chunk["data"]) for chunk in chunks)
+    
+    with track_stage("decompress", field):
+        raw = await asyncio.to_thread(zlib.decompress, compressed)
+    if descriptor["encoding"] == "zlib+utf8":
+        return raw.decode("utf-8")
+    return json.loads(raw)
+
+async def read_document_text_range(document: dict, start: int, end: int) -> bytes:
+    """Return bytes [start, end] of the extracted text, decompressing only as far as needed"""
+    descriptor = document.get("content", {}).get("extracted_text")
+    if descriptor is None or descriptor["encoding"] != "zlib+utf8":
+        text = await load_document_field(document, "extracted_text")
+        return text.encode("utf-8")[start:end + 1]
+    
+    parts = []
+    offset = 0
+    with track_stage("decompress", "extracted_text.range"):
+        async for piece in iter_document_field_bytes(document, "extracted_text"):
+            piece_end = offset + len(piece)
+            if piece_end > start:
+                parts.append(piece[max(start - offset, 0):end + 1 - offset])
+            offset = piece_end
+            if offset > end:
+                break
+    return b"".join(parts)
+
+# Document search
+SEARCH_TOKEN_PATTERN = re.compile(r"[a-z][a-z0-9]+")
+
+def build_search_entry(document_id: str, filename: str, uploaded_at: datetime, extracted_text: str, analysis: dict) -> dict:
+    """Derive the search document: boosted knowledge-base names, analysis terms and the text's vocabulary"""
+    get_knowledge_base_index()
+    analysis_text = analysis.get("analysis", "") if isinstance(analysis, dict) else str(analysis)
+    combined = f"{extracted_text}\n{analysis_text}".lower()
+    
+    boosted = {"conditions": set(), "medicines": set()}
+    for match in SEARCH_BOOST["pattern"].finditer(combined):
+        kind, name = SEARCH_BOOST["terms"][match.group(1)]
+        boosted[kind].add(name)
+    
+    # The text index only needs each word once, which keeps large OCR dumps small here
+    return {
+        "document_id": document_id,
+        "filename": filename,
+        "uploaded_at": uploaded_at,
+        "conditions": sorted(boosted["conditions"]),
+        "medicines": sorted(boosted["medicines"]),
+        "analysis_terms": " ".join(sorted(set(SEARCH_TOKEN_PATTERN.findall(analysis_text.lower())))),
+        "body": " ".join(sorted(set(SEARCH_TOKEN_PATTERN.findall(extracted_text.lower()))))
+    }
+
+async def index_document_for_search(document_id: str, filename: str, uploaded_at: datetime, extracted_text: str, analysis: dict):
+    """Add one document to the search index; Mongo maintains the text index incrementally"""
+    entry = await asyncio.to_thread(build_search_entry, document_id, filename, uploaded_at, extracted_text, analysis)
+    with track_stage("mongo", "document_search.replace_one"):
+        await db.document_search.replace_one({"document_id": document_id}, entry, upsert=True)
+    # Marks the document so the startup backfill never has to look at it again
+    with track_stage("mongo", "medical_documents.update_one"):
+        await db.medical_documents.update_one({"document_id": document_id}, {"$set": {"search_indexed_at": datetime.utcnow()}})
+
+# Shielded writes that outlived a cancelled request; held so they aren't garbage collected mid-write
+detached_writes = set()
+
+async def persist_medical_document(metadata: dict, content: dict):
+    """Store a document and add it to the search index, to completion even if the request is cancelled.
+
+    Cancelling between the blob chunks and the metadata insert would orphan the chunks, and
+    cancelling after it would leave the document out of search until the next backfill.
+    """
+    async def persist():
+        await store_medical_document(metadata, content)
+        try:
+            await index_document_for_search(
+                metadata["document_id"], metadata["filename"], metadata["uploaded_at"],
+                content["extracted_text"], content["analysis"]
+            )
+        except Exception as e:
+            # The document is stored either way; a failed index write shouldn't fail the upload
+            logging.error(f"Error indexing document {metadata['document_id']} for search: {str(e)}")
+    
+    task = asyncio.ensure_future(persist())
+    detached_writes.add(task)
+    task.add_done_callback(detached_writes.discard)
+    await asyncio.shield(task)
+
+async def backfill_search_index() -> int:
+    """Index stored documents without a search_indexed_at marker (uploads from before search, or failed index writes).
+
+    Only unmarked documents are read, through the (search_indexed_at, _id) index, so once the
+    collection has been caught up a restart costs a single empty index lookup. Documents indexed
+    before the marker existed only get the marker set.
+    """
+    indexed = 0
+    last_id = None
+    while True:
+        query = {"search_indexed_at": None}
+        if last_id is not None:
+            # Documents that fail to index stay unmarked; move past them instead of retrying forever
+            query["_id"] = {"$gt": last_id}
+        with track_stage("mongo", "medical_documents.find"):
+            batch = await db.medical_documents.find(
+                query, {"_id": 1, "document_id": 1}
+            ).sort("_id", 1).limit(SEARCH_BACKFILL_BATCH_SIZE).to_list(SEARCH_BACKFILL_BATCH_SIZE)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+        
+        document_ids = [doc["document_id"] for doc in batch]
+        with track_stage("mongo", "document_search.find"):
+            existing = await db.document_search.find(
+                {"document_id": {"$in": document_ids}}, {"_id": 0, "document_id": 1}
+            ).to_list(None)
+        already_indexed = [entry["document_id"] for entry in existing]
+        if already_indexed:
+            with track_stage("mongo", "medical_documents.update_many"):
+                await db.medical_documents.update_many(
+                    {"document_id": {"$in": already_indexed}}, {"$set": {"search_indexed_at": datetime.utcnow()}}
+                )
+        
+        for document_id in document_ids:
+            if document_id in already_indexed:
+                continue
+            try:
+                document = await get_document(document_id, ("extracted_text", "analysis"))
+                if not document:
+                    continue
+                await index_document_for_search(
+                    document_id,
+                    document.get("filename") or "",
+                    document.get("uploaded_at"),
+                    document.get("extracted_text") or "",
+                    document.get("analysis") or {}
+                )
+                indexed += 1
+            except Exception as e:
+                # One unreadable document shouldn't keep every later one out of the index
+                logging.error(f"Error indexing document {document_id} for search: {str(e)}")
+        if len(batch) < SEARCH_BACKFILL_BATCH_SIZE:
+            break
+    return indexed
+
+# Bulk export
+# dataset -> (collection, time field used by since/until)
+EXPORT_DATASETS = {
+    "sessions": ("diagnosis_sessions", "timestamp"),
+    "sessions_archive": ("diagnosis_sessions_archive", "completed_at"),
+    "documents": ("medical_documents", "uploaded_at"),
+}
+
+def encode_export_cursor(state: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state).encode("utf-8")).decode("ascii")
+
+EXPORT_FORMATS = ("ndjson", "columnar")
+
+def decode_export_cursor(token: str) -> dict:
+    """Parse a resume token, re-validating and re-clamping everything since the client can edit it"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        fields = state.get("fields") or []
+        for key in ("since", "until", "after_time"):
+            if state.get(key) is not None:
+                datetime.fromisoformat(state[key])
+        if state.get("after") and (state.get("since") or state.get("until")) and not state.get("after_time"):
+            raise ValueError("Time-filtered cursors resume from a time and an _id")
+        if state["dataset"] not in EXPORT_DATASETS or state["format"] not in EXPORT_FORMATS:
+            raise ValueError("Unknown dataset or format")
+        if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+            raise ValueError("Fields must be a list of names")
+        return {
+            "dataset": state["dataset"],
+            "format": state["format"],
+            "since": state.get("since"),
+            "until": state.get("until"),
+            "fields": fields,
+            "batch_size": min(max(int(state["batch_size"]), 1), EXPORT_MAX_BATCH_SIZE),
+            "after": str(ObjectId(state["after"])) if state.get("after") else None,
+            "after_time": state.get("after_time")
+        }
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid export cursor")
+
+def export_json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (bytes, ObjectId)):
+        return str(value)
+    raise TypeError(f"Cannot export {type(value).__name__}")
+
+async def stream_export(state: dict):
+    """Stream a dataset in _id order, or (time, _id) order when filtered by time, through a bounded server-side cursor.
+
+    A batch ends after batch_size rows or EXPORT_MAX_BATCH_BYTES of serialized rows, whichever
+    comes first, so memory stays bounded even when rows carry decompressed text. Each batch is followed by a checkpoint carrying a cursor token that resumes right after it.
+    The generator is only advanced as the client reads, so a slow consumer throttles the Mongo cursor.
+    """
+    collection_name, time_field = EXPORT_DATASETS[state["dataset"]]
+    # Prefer secondaries so exports don't compete with live traffic on the primary
+    collection = db[collection_name].with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+    
+    query = {}
+    time_range = {}
+    if state.get("since"):
+        time_range["$gte"] = datetime.fromisoformat(state["since"])
+    if state.get("until"):
+        time_range["$lt"] = datetime.fromisoformat(state["until"])
+    # A time filter is served by the (time field, _id) index, so walk and checkpoint in that order
+    ordered_by_time = bool(time_range)
+    if time_range:
+        query[time_field] = time_range
+    if state.get("after"):
+        after_id = ObjectId(state["after"])
+        if ordered_by_time:
+            after_time = datetime.fromisoformat(state["after_time"])
+            query["$or"] = [{time_field: {"$gt": after_time}}, {time_field: after_time, "_id": {"$gt": after_id}}]
+        else:
+            query["_id"] = {"$gt": after_id}
+    
+    fields = state.get("fields") or []
+    content_fields = tuple(field for field in fields if field in DOCUMENT_CONTENT_FIELDS) if state["dataset"] == "documents" else ()
+    if fields:
+        projection = {field: 1 for field in fields if field not in content_fields}
+        projection.update({f"content.{field}": 1 for field in content_fields})
+        # Documents stored before compression keep these fields at top level
+        projection.update({field: 1 for field in content_fields})
+        if content_fields:
+            projection["document_id"] = 1
+        if ordered_by_time:
+            projection[time_field] = 1
+    elif state["dataset"] == "documents":
+        projection = document_projection()
+        projection.pop("_id")
+    else:
+        projection = None
+    
+    batch_size = state["batch_size"]
+    columnar = state["format"] == "columnar"
+    sort = [(time_field, 1), ("_id", 1)] if ordered_by_time else [("_id", 1)]
+    cursor = collection.find(query, projection).sort(sort).batch_size(batch_size)
+    # NDJSON rows are held already serialized; columnar rows stay dicts until the batch is pivoted
+    rows = []
+    pending_bytes = 0
+    last_id = None
+    last_time = None
+    
+    def checkpoint() -> str:
+        return encode_export_cursor({
+            **state, "after": str(last_id), "after_time": last_time.isoformat() if ordered_by_time else None
+        })
+    
+    def flush() -> str:
+        if columnar:
+            columns = {}
+            for index, row in enumerate(rows):
+                for key, value in row.items():
+                    columns.setdefault(key, [None] * len(rows))[index] = value
+            return json.dumps({"rows": len(rows), "columns": columns, "_checkpoint": checkpoint()}, default=export_json_default) + "\n"
+        return "\n".join(rows + [json.dumps({"_checkpoint": checkpoint()})]) + "\n"
+    
+    async for doc in cursor:
+        last_id = doc.pop("_id")
+        if ordered_by_time:
+            last_time = doc[time_field] if not fields or time_field in fields else doc.pop(time_field)
+        for field in content_fields:
+            doc[field] = await load_document_field(doc, field)
+        if content_fields:
+            doc.pop("content", None)
+            if "document_id" not in fields:
+                doc.pop("document_id", None)
+        line = json.dumps(doc, default=export_json_default)
+        rows.append(doc if columnar else line)
+        pending_bytes += len(line)
+        if len(rows) >= batch_size or pending_bytes >= EXPORT_MAX_BATCH_BYTES:
+            EXPORT_ROWS.inc(len(rows), dataset=state["dataset"])
+            yield flush()
+            rows = []
+            pending_bytes = 0
+    
+    if rows:
+        EXPORT_ROWS.inc(len(rows), dataset=state["dataset"])
+        yield flush()
+    yield json.dumps({"_complete": True}) + "\n"
+
+def summarize_document(analysis: dict) -> str:
+    text = analysis.get("analysis", "") if isinstance(analysis, dict) else str(analysis)
+    if len(text) <= DOCUMENT_SUMMARY_CHARS:
+        return text
+    return text[:DOCUMENT_SUMMARY_CHARS].rsplit(" ", 1)[0] + "…"
+
+async def get_document(document_id: str, include: tuple = ()) -> Optional[dict]:
+    """Fetch document metadata, decompressing only the content fields listed in include"""
+    with track_stage("mongo", "medical_documents.find_one"):
+        document = await db.medical_documents.find_one({"document_id": document_id}, document_projection(include))
+    if not document:
+        return None
+    
+    for field in include:
+        document[field] = await load_document_field(document, field)
+    for descriptor in document.get("content", {}).values():
+        descriptor.pop("data", None)
+    return document
+
 # API Endpoints
 
 @api_router.post("/start-diagnosis", response_model=DiagnosisResult)
-async def start_diagnosis():
+async def start_diagnosis(request: Request):
     """Start a new medical diagnosis session"""
+    return await run_cancellable(request, begin_diagnosis(), "start_diagnosis")
+
+async def begin_diagnosis():
     session_id = str(uuid.uuid4())
     
-    first_question = await get_gemini_response(
-        session_id, 
-        "I want to start a medical diagnosis. Please ask me the first question to help diagnose my condition.",
-        []
-    )
+    try:
+        first_turn = await get_diagnosis_turn(
+            session_id, 
+            "I want to start a medical diagnosis. Please ask me the first question to help diagnose my condition.",
+            []
+        )
+    except HTTPException:
+        # The opening question doesn't depend on the model, so fall back to the default one
+        first_turn = DiagnosisTurn(type="question")
+    first_question = first_turn.question or "Are you currently experiencing any pain or discomfort?"
     
     session = DiagnosisSession(
         session_id=session_id,
         current_question=first_question,
         user_responses=[],
         confidence_score=0.0,
-        potential_conditions=[]
+        potential_conditions=[],
+        llm_calls=1,
+        expires_at=session_expiry()
     )
     
-    await db.diagnosis_sessions.insert_one(session.dict())
+    check_deadline("mongo_write")
+    with track_stage("mongo", "diagnosis_sessions.insert_one"):
+        await db.diagnosis_sessions.insert_one(session.dict())
     
     return DiagnosisResult(
         session_id=session_id,
@@ -294,70 +1382,106 @@ async def start_diagnosis():
     )
 
 @api_router.post("/answer-question", response_model=DiagnosisResult)
-async def answer_question(response: UserResponse):
+async def answer_question(response: UserResponse, request: Request):
     """Process user's answer and get next question or diagnosis"""
+    return await run_cancellable(request, process_answer(response), "answer_question")
+
+async def process_answer(response: UserResponse):
     try:
-        session_doc = await db.diagnosis_sessions.find_one({"session_id": response.session_id})
+        with track_stage("mongo", "diagnosis_sessions.find_one"):
+            session_doc = await db.diagnosis_sessions.find_one({"session_id": response.session_id})
         if not session_doc:
             raise HTTPException(status_code=404, detail="Session not found")
         
         session = DiagnosisSession(**session_doc)
         session.user_responses.append(f"Q: {session.current_question}\nA: {response.answer}")
         
-        next_response = await get_gemini_response(
+        turn = await get_diagnosis_turn(
             response.session_id,
             response.answer,
             session.user_responses
         )
+        session.llm_calls += 1
+        session.last_activity = datetime.utcnow()
+        # An unparseable reply keeps the previous ranking rather than resetting confidence to zero
+        if turn.structured:
+            session.ranked_conditions = turn.conditions
+            session.potential_conditions = [c.name for c in turn.conditions]
+            session.confidence_score = turn.conditions[0].probability if turn.conditions else 0.0
         
-        is_diagnosis = any(word in next_response.lower() for word in ["diagnosed", "condition", "likely", "probably", "appears to be"])
-        
-        if is_diagnosis or len(session.user_responses) >= 10:
-            session.final_diagnosis = next_response
-            session.confidence_score = 0.8
+        # Stop as soon as the top condition clears the threshold instead of guessing from keywords
+        is_confident = session.confidence_score >= DIAGNOSIS_CONFIDENCE_THRESHOLD
+        if is_confident or not turn.question or len(session.user_responses) >= MAX_DIAGNOSIS_TURNS:
+            top_condition = session.ranked_conditions[0] if session.ranked_conditions else None
+            if turn.diagnosis:
+                final_diagnosis = turn.diagnosis
+            elif top_condition:
+                final_diagnosis = f"Most likely condition: {top_condition.name} ({top_condition.probability:.0%} confidence)"
+            else:
+                final_diagnosis = turn.question or "Unable to reach a confident diagnosis"
+            session.final_diagnosis = final_diagnosis
+            session.completed_at = session.last_activity
+            session.expires_at = None
             
-            condition_name = extract_condition_name(next_response)
+            condition_name = extract_condition_name(top_condition.name if top_condition else final_diagnosis)
+            if condition_name == "Unknown Condition":
+                condition_name = extract_condition_name(final_diagnosis)
             recommendations = get_recommendations(condition_name)
             session.recommendations = recommendations
             
-            await db.diagnosis_sessions.update_one(
-                {"session_id": response.session_id},
-                {"$set": session.dict()}
-            )
+            check_deadline("mongo_write")
+            with track_stage("mongo", "diagnosis_sessions.update_one"):
+                await db.diagnosis_sessions.update_one(
+                    {"session_id": response.session_id},
+                    {"$set": session.dict()}
+                )
+            record_completed_session(session.llm_calls)
             
             return DiagnosisResult(
                 session_id=response.session_id,
                 question=None,
                 confidence_score=session.confidence_score,
                 potential_conditions=[condition_name] if condition_name else [],
-                final_diagnosis=next_response,
+                ranked_conditions=session.ranked_conditions,
+                final_diagnosis=final_diagnosis,
                 recommendations=recommendations,
                 is_complete=True
             )
         else:
-            session.current_question = next_response
-            session.confidence_score = min(0.1 * len(session.user_responses), 0.7)
+            session.current_question = turn.question
+            session.expires_at = session_expiry()
             
-            await db.diagnosis_sessions.update_one(
-                {"session_id": response.session_id},
-                {"$set": session.dict()}
-            )
+            check_deadline("mongo_write")
+            with track_stage("mongo", "diagnosis_sessions.update_one"):
+                await db.diagnosis_sessions.update_one(
+                    {"session_id": response.session_id},
+                    {"$set": session.dict()}
+                )
             
             return DiagnosisResult(
                 session_id=response.session_id,
-                question=next_response,
+                question=turn.question,
                 confidence_score=session.confidence_score,
                 potential_conditions=session.potential_conditions,
+                ranked_conditions=session.ranked_conditions,
                 is_complete=False
             )
             
+    except (DeadlineExceeded, HTTPException):
+        raise
     except Exception as e:
         logging.error(f"Error processing answer: {str(e)}")
         raise HTTPException(status_code=500, detail="Error processing your answer")
 
 @api_router.post("/upload-medical-document")
-async def upload_medical_document(file: UploadFile = File(...)):
-    """Upload and analyze medical documents (PDF or images)"""
+async def upload_medical_document(request: Request, file: UploadFile = File(...), response_mode: Literal["full", "lean"] = "full") -> Union[DocumentAnalysis, DocumentSummary]:
+    """Upload and analyze medical documents (PDF or images).
+
+    response_mode=lean returns the document id and a summary instead of echoing the extracted text.
+    """
+    return await run_cancellable(request, process_medical_document(file, response_mode), "upload_medical_document", priority="bulk")
+
+async def process_medical_document(file: UploadFile, response_mode: str):
     allowed_types = ['application/pdf', 'image/png', 'image/jpeg', 'image/jpg']
     if file.content_type not in allowed_types:
         raise HTTPException(
@@ -368,10 +1492,14 @@ async def upload_medical_document(file: UploadFile = File(...)):
     try:
         file_content = await file.read()
         
-        if file.content_type == 'application/pdf':
-            extracted_text = DocumentProcessor.extract_text_from_pdf(file_content)
-        else:
-            extracted_text = DocumentProcessor.extract_text_from_image(file_content)
+        OCR_IN_FLIGHT.inc()
+        try:
+            if file.content_type == 'application/pdf':
+                extracted_text = await DocumentProcessor.extract_text_from_pdf(file_content)
+            else:
+                extracted_text = await DocumentProcessor.extract_text_from_image(file_content)
+        finally:
+            OCR_IN_FLIGHT.dec()
         
         # Analyze with Gemini
         analysis = await analyze_medical_document(extracted_text)
@@ -380,130 +1508,436 @@ async def upload_medical_document(file: UploadFile = File(...)):
         recommendations = await get_document_recommendations(extracted_text)
         
         # Save to database
-        document = {
-            "document_id": str(uuid.uuid4()),
-            "filename": file.filename,
-            "file_type": file.content_type,
-            "extracted_text": extracted_text,
-            "analysis": analysis,
-            "recommendations": recommendations,
-            "uploaded_at": datetime.utcnow()
-        }
-        await db.medical_documents.insert_one(document)
+        check_deadline("mongo_write")
+        document_id = str(uuid.uuid4())
+        await persist_medical_document(
+            {
+                "document_id": document_id,
+                "filename": file.filename,
+                "file_type": file.content_type,
+                "uploaded_at": datetime.utcnow()
+            },
+            {
+                "extracted_text": extracted_text,
+                "analysis": analysis,
+                "recommendations": recommendations
+            }
+        )
+        
+        if response_mode == "lean":
+            return DocumentSummary(
+                document_id=document_id,
+                filename=file.filename,
+                summary=summarize_document(analysis),
+                text_size=len(extracted_text.encode("utf-8")),
+                text_url=f"/api/documents/{document_id}/text",
+                recommendations=recommendations
+            )
         
         return DocumentAnalysis(
+            document_id=document_id,
             filename=file.filename,
             extracted_text=extracted_text,
             analysis=analysis,
             recommendations=recommendations
         )
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
 @api_router.post("/get-medicine-suggestions")
-async def get_medicine_suggestions(request: MedicineRequest):
+async def get_medicine_suggestions(request: MedicineRequest) -> dict:
     """Get medicine suggestions for a specific disease"""
     condition = find_condition_by_name(request.disease_name)
+    KNOWLEDGE_BASE_LOOKUPS.inc(endpoint="medicine_suggestions", result="hit" if condition else "miss")
     if condition:
-        return {
-            "disease": condition["name"],
-            "medicines": condition["medicines"],
-            "description": condition["description"],
-            "doctor_specialization": condition["doctor_specialization"],
-            "disclaimer": "⚠️ This is for informational purposes only. Consult a healthcare professional before taking any medication."
-        }
+        return knowledge_base_medicine_suggestions(condition)
     else:
         # Use Gemini for unknown conditions
         try:
-            chat = LlmChat(
-                api_key=GEMINI_API_KEY,
-                session_id=str(uuid.uuid4()),
-                system_message="You are a medical expert providing medicine suggestions."
-            ).with_model("gemini", "gemini-2.0-flash")
-            
-            message = UserMessage(
-                text=f"Provide common over-the-counter medicine suggestions for {request.disease_name}. Include dosages and precautions."
+            response = await send_llm_message(
+                "You are a medical expert providing medicine suggestions.",
+                f"Provide common over-the-counter medicine suggestions for {request.disease_name}. Include dosages and precautions.",
+                purpose="medicine_suggestions"
             )
             
-            response = await chat.send_message(message)
-            
-            return {
-                "disease": request.disease_name,
-                "ai_suggestions": response,
-                "disclaimer": "⚠️ AI-generated suggestions. Always consult a healthcare professional."
-            }
+            return ai_medicine_suggestions(request.disease_name, response)
         except Exception as e:
             raise HTTPException(status_code=500, detail="Error getting medicine suggestions")
 
 @api_router.post("/get-exercise-suggestions")
-async def get_exercise_suggestions(request: ExerciseRequest):
+async def get_exercise_suggestions(request: ExerciseRequest) -> dict:
     """Get exercise and diet suggestions for a specific condition"""
     condition = find_condition_by_name(request.condition)
+    KNOWLEDGE_BASE_LOOKUPS.inc(endpoint="exercise_suggestions", result="hit" if condition else "miss")
     if condition:
-        return {
-            "condition": condition["name"],
-            "exercises": condition["exercises"],
-            "diet": condition.get("diet", []),
-            "description": condition["description"],
-            "disclaimer": "⚠️ Consult your doctor before starting any exercise program."
-        }
+        return knowledge_base_exercise_suggestions(condition)
     else:
         # Use Gemini for unknown conditions
         try:
-            chat = LlmChat(
-                api_key=GEMINI_API_KEY,
-                session_id=str(uuid.uuid4()),
-                system_message="You are a fitness and nutrition expert providing exercise and diet advice for medical conditions."
-            ).with_model("gemini", "gemini-2.0-flash")
-            
-            message = UserMessage(
-                text=f"Provide safe exercise recommendations and dietary guidelines for someone with {request.condition}."
+            response = await send_llm_message(
+                "You are a fitness and nutrition expert providing exercise and diet advice for medical conditions.",
+                f"Provide safe exercise recommendations and dietary guidelines for someone with {request.condition}.",
+                purpose="exercise_suggestions"
             )
             
-            response = await chat.send_message(message)
-            
-            return {
-                "condition": request.condition,
-                "ai_suggestions": response,
-                "disclaimer": "⚠️ AI-generated suggestions. Consult healthcare professionals before making changes."
-            }
+            return ai_exercise_suggestions(request.condition, response)
         except Exception as e:
             raise HTTPException(status_code=500, detail="Error getting exercise suggestions")
 
+@api_router.post("/get-batch-suggestions")
+async def get_batch_suggestions(request: BatchSuggestionRequest, http_request: Request) -> dict:
+    """Get medicine and/or exercise suggestions for many conditions in one call.
+
+    Knowledge-base hits are answered locally; misses share batched Gemini prompts.
+    A failed prompt only marks its own conditions as errored.
+    """
+    if not request.conditions or len(request.conditions) > BATCH_SUGGESTION_MAX_CONDITIONS:
+        raise HTTPException(status_code=400, detail=f"Provide between 1 and {BATCH_SUGGESTION_MAX_CONDITIONS} conditions")
+    if not request.include:
+        raise HTTPException(status_code=400, detail="Include medicines, exercises or both")
+    
+    conditions = []
+    seen = set()
+    for name in request.conditions:
+        name = name.strip()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            conditions.append(name)
+    if not conditions:
+        raise HTTPException(status_code=400, detail="Condition names must not be blank")
+    
+    results = {}
+    misses = []
+    for name in conditions:
+        condition = find_condition_by_name(name)
+        KNOWLEDGE_BASE_LOOKUPS.inc(endpoint="batch_suggestions", result="hit" if condition else "miss")
+        if condition:
+            results[name] = {"source": "knowledge_base"}
+            if "medicines" in request.include:
+                results[name]["medicine"] = knowledge_base_medicine_suggestions(condition)
+            if "exercises" in request.include:
+                results[name]["exercise"] = knowledge_base_exercise_suggestions(condition)
+        else:
+            misses.append(name)
+    
+    groups = [misses[i:i + BATCH_SUGGESTION_GROUP_SIZE] for i in range(0, len(misses), BATCH_SUGGESTION_GROUP_SIZE)]
+    limit = asyncio.Semaphore(BATCH_SUGGESTION_CONCURRENCY)
+    
+    async def resolve_group(group: List[str]):
+        async with limit:
+            try:
+                suggestions = await get_batched_ai_suggestions(group, request.include)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logging.error(f"Batched suggestion error: {str(e)}")
+                suggestions = {}
+        for name in group:
+            entry = suggestions.get(name)
+            if not isinstance(entry, dict):
+                results[name] = {"source": "ai", "error": "Could not generate suggestions for this condition"}
+                continue
+            results[name] = {"source": "ai"}
+            if "medicines" in request.include:
+                results[name]["medicine"] = ai_medicine_suggestions(name, entry.get("medicines", ""))
+            if "exercises" in request.include:
+                results[name]["exercise"] = ai_exercise_suggestions(name, entry.get("exercises", ""))
+    
+    async def resolve_all():
+        await asyncio.gather(*(resolve_group(group) for group in groups))
+    
+    # Groups must be started inside run_cancellable so their tasks inherit its deadline and priority.
+    # Care-plan screens wait on this response, so it is interactive work despite the batching.
+    await run_cancellable(http_request, resolve_all(), "batch_suggestions")
+    
+    return {
+        "results": {name: results[name] for name in conditions},
+        "llm_calls": len(groups)
+    }
+
 @api_router.get("/conditions")
-async def get_medical_conditions():
+async def get_medical_conditions() -> List[dict]:
     """Get all available medical conditions"""
     return MEDICAL_CONDITIONS
 
+@api_router.get("/diagnosis-stats")
+async def get_diagnosis_stats() -> dict:
+    """Get diagnosis loop efficiency metrics for this worker"""
+    completed = int(DIAGNOSIS_SESSIONS_COMPLETED.value())
+    llm_calls = int(DIAGNOSIS_LLM_CALLS.value())
+    return {
+        "completed_sessions": completed,
+        "llm_calls": llm_calls,
+        "avg_llm_calls_per_session": llm_calls / completed if completed else 0.0,
+        "confidence_threshold": DIAGNOSIS_CONFIDENCE_THRESHOLD,
+        "max_turns": MAX_DIAGNOSIS_TURNS
+    }
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles() -> List[dict]:
+    """List recent request profiles, newest first"""
+    return await asyncio.to_thread(list_profiles)
+
+@api_router.get("/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+async def get_profile(name: str):
+    """Download a profile in speedscope format (open at https://www.speedscope.app)"""
+    path = PROFILE_DIR / name
+    if not PROFILE_NAME_PATTERN.match(name) or not path.is_file():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=name)
+
+@api_router.get("/documents", dependencies=[Depends(require_admin)])
+async def list_documents(limit: int = 20, skip: int = 0) -> List[dict]:
+    """List uploaded documents (metadata only, newest first)"""
+    limit = min(max(limit, 1), 100)
+    with track_stage("mongo", "medical_documents.find"):
+        documents = await db.medical_documents.find({}, document_projection()).sort("uploaded_at", -1).skip(skip).limit(limit).to_list(limit)
+    return documents
+
+@api_router.get("/documents/search", dependencies=[Depends(require_admin)])
+async def search_documents(q: str, condition: Optional[str] = None, page: int = 1, page_size: int = 20) -> dict:
+    """Full-text search over uploaded documents, ranked with condition and medicine names boosted"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+    
+    query = {"$text": {"$search": q}}
+    if condition:
+        query["conditions"] = condition
+    projection = {
+        "_id": 0, "document_id": 1, "filename": 1, "uploaded_at": 1, "conditions": 1, "medicines": 1,
+        "score": {"$meta": "textScore"}
+    }
+    # Fetch one extra row to know whether another page exists without a full count
+    with track_stage("mongo", "document_search.find"):
+        results = await db.document_search.find(query, projection).sort(
+            [("score", {"$meta": "textScore"})]
+        ).skip((page - 1) * page_size).limit(page_size + 1).to_list(page_size + 1)
+    
+    return {
+        "query": q,
+        "page": page,
+        "page_size": page_size,
+        "has_more": len(results) > page_size,
+        "results": results[:page_size]
+    }
+
+@api_router.get("/documents/{document_id}", dependencies=[Depends(require_admin)])
+async def get_medical_document(document_id: str, include: str = "") -> dict:
+    """Get a document's metadata; include=analysis,recommendations,extracted_text decompresses those fields"""
+    fields = tuple(field for field in include.split(",") if field)
+    unknown = [field for field in fields if field not in DOCUMENT_CONTENT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    
+    document = await get_document(document_id, fields)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+@api_router.get("/documents/{document_id}/text", dependencies=[Depends(require_admin)])
+async def get_document_text(document_id: str, request: Request):
+    """Get a document's extracted text as UTF-8; supports a single "Range: bytes=start-end" header"""
+    with track_stage("mongo", "medical_documents.find_one"):
+        document = await db.medical_documents.find_one(
+            {"document_id": document_id},
+            {"_id": 0, "document_id": 1, "content.extracted_text": 1, "extracted_text": 1}
+        )
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    descriptor = document.get("content", {}).get("extracted_text")
+    size = descriptor["size"] if descriptor else len(document.get("extracted_text", "").encode("utf-8"))
+    range_header = request.headers.get("range")
+    if not range_header:
+        text = await load_document_field(document, "extracted_text")
+        return PlainTextResponse(text, headers={"Accept-Ranges": "bytes"})
+    
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or match.groups() == ("", ""):
+        raise HTTPException(status_code=416, detail="Only a single bytes range is supported")
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or start > end:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    
+    body = await read_document_text_range(document, start, end)
+    return Response(
+        body,
+        status_code=206,
+        media_type="text/plain; charset=utf-8",
+        # Identity encoding keeps the compression middleware from re-encoding a partial body
+        headers={"Content-Range": f"bytes {start}-{end}/{size}", "Accept-Ranges": "bytes", "Content-Encoding": "identity"}
+    )
+
+@api_router.get("/admin/export/{dataset}", dependencies=[Depends(require_admin)])
+async def export_dataset(
+    dataset: Literal["sessions", "sessions_archive", "documents"],
+    format: Literal["ndjson", "columnar"] = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    batch_size: int = EXPORT_DEFAULT_BATCH_SIZE,
+    cursor: Optional[str] = None
+):
+    """Stream a dataset as NDJSON rows or columnar batches.
+
+    Pass the last "_checkpoint" token back as cursor to resume; it carries the original filters.
+    """
+    if cursor:
+        state = decode_export_cursor(cursor)
+        if state.get("dataset") != dataset:
+            raise HTTPException(status_code=400, detail="Cursor belongs to a different dataset")
+    else:
+        state = {
+            "dataset": dataset,
+            "format": format,
+            "since": since.isoformat() if since else None,
+            "until": until.isoformat() if until else None,
+            "fields": [field for field in (fields or "").split(",") if field],
+            "batch_size": min(max(batch_size, 1), EXPORT_MAX_BATCH_SIZE),
+            "after": None,
+            "after_time": None
+        }
+    return StreamingResponse(stream_export(state), media_type="application/x-ndjson")
+
 @api_router.get("/session/{session_id}")
-async def get_session(session_id: str):
+async def get_session(session_id: str) -> DiagnosisSession:
     """Get diagnosis session by ID"""
-    session_doc = await db.diagnosis_sessions.find_one({"session_id": session_id})
+    with track_stage("mongo", "diagnosis_sessions.find_one"):
+        session_doc = await db.diagnosis_sessions.find_one({"session_id": session_id})
+    if not session_doc:
+        # Completed sessions are moved to the archive by the compactor
+        with track_stage("mongo", "diagnosis_sessions_archive.find_one"):
+            session_doc = await db.diagnosis_sessions_archive.find_one({"session_id": session_id})
     if not session_doc:
         raise HTTPException(status_code=404, detail="Session not found")
     return DiagnosisSession(**session_doc)
 
 # Helper Functions
+def session_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=SESSION_IDLE_TTL_SECONDS)
+
+def compact_session(session_doc: dict) -> dict:
+    """Archive form of a completed session: outcome only, per-turn fields trimmed"""
+    return {
+        "session_id": session_doc["session_id"],
+        "confidence_score": session_doc.get("confidence_score", 0.0),
+        "potential_conditions": session_doc.get("potential_conditions", []),
+        "ranked_conditions": session_doc.get("ranked_conditions", []),
+        "llm_calls": session_doc.get("llm_calls", 0),
+        "turns": len(session_doc.get("user_responses", [])),
+        "final_diagnosis": session_doc.get("final_diagnosis"),
+        "recommendations": session_doc.get("recommendations"),
+        "timestamp": session_doc.get("timestamp"),
+        "last_activity": session_doc.get("completed_at"),
+        "completed_at": session_doc.get("completed_at"),
+        "archived": True,
+        "archived_at": datetime.utcnow()
+    }
+
+async def archive_completed_sessions() -> int:
+    """Move sessions completed more than SESSION_ARCHIVE_AFTER_SECONDS ago into the archive"""
+    cutoff = datetime.utcnow() - timedelta(seconds=SESSION_ARCHIVE_AFTER_SECONDS)
+    archived = 0
+    while True:
+        with track_stage("mongo", "diagnosis_sessions.find"):
+            batch = await db.diagnosis_sessions.find(
+                {"completed_at": {"$lt": cutoff}}, {"_id": 0}
+            ).limit(SESSION_ARCHIVE_BATCH_SIZE).to_list(SESSION_ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        
+        # Upsert first, then delete, so a crash in between only leaves a duplicate that the next pass cleans up
+        with track_stage("mongo", "diagnosis_sessions_archive.bulk_write"):
+            await db.diagnosis_sessions_archive.bulk_write(
+                [ReplaceOne({"session_id": doc["session_id"]}, compact_session(doc), upsert=True) for doc in batch],
+                ordered=False
+            )
+        with track_stage("mongo", "diagnosis_sessions.delete_many"):
+            await db.diagnosis_sessions.delete_many({"session_id": {"$in": [doc["session_id"] for doc in batch]}})
+        
+        archived += len(batch)
+        SESSIONS_ARCHIVED.inc(len(batch))
+        if len(batch) < SESSION_ARCHIVE_BATCH_SIZE:
+            break
+    return archived
+
+def session_reference_time(session_doc: dict) -> datetime:
+    return session_doc.get("last_activity") or session_doc.get("timestamp") or datetime.utcnow()
+
+async def backfill_session_lifecycle() -> int:
+    """Give sessions written before the lifecycle fields existed an expires_at or completed_at.
+
+    Without them the TTL index never removes old abandoned sessions and the compactor never
+    archives old completed ones. Each pass only matches sessions still missing the field, so
+    an interrupted backfill resumes where it stopped.
+    """
+    ttl = timedelta(seconds=SESSION_IDLE_TTL_SECONDS)
+    upgrades = (
+        ({"final_diagnosis": None, "expires_at": None},
+         lambda doc: {"expires_at": session_reference_time(doc) + ttl}),
+        ({"final_diagnosis": {"$ne": None}, "completed_at": None},
+         lambda doc: {"completed_at": session_reference_time(doc), "expires_at": None}),
+    )
+    updated = 0
+    for query, fields in upgrades:
+        while True:
+            with track_stage("mongo", "diagnosis_sessions.find"):
+                batch = await db.diagnosis_sessions.find(
+                    query, {"_id": 1, "timestamp": 1, "last_activity": 1}
+                ).limit(SESSION_ARCHIVE_BATCH_SIZE).to_list(SESSION_ARCHIVE_BATCH_SIZE)
+            if not batch:
+                break
+            with track_stage("mongo", "diagnosis_sessions.bulk_write"):
+                await db.diagnosis_sessions.bulk_write(
+                    [UpdateOne({"_id": doc["_id"]}, {"$set": fields(doc)}) for doc in batch],
+                    ordered=False
+                )
+            updated += len(batch)
+            if len(batch) < SESSION_ARCHIVE_BATCH_SIZE:
+                break
+    return updated
+
+async def run_session_compactor():
+    while True:
+        try:
+            archived = await archive_completed_sessions()
+            if archived:
+                logger.info(f"Archived {archived} completed diagnosis sessions")
+        except Exception as e:
+            logger.error(f"Session compactor error: {str(e)}")
+        await asyncio.sleep(SESSION_ARCHIVE_INTERVAL_SECONDS)
+
 def extract_condition_name(diagnosis_text: str) -> str:
     """Extract condition name from diagnosis text"""
-    for condition in MEDICAL_CONDITIONS:
-        if condition["name"].lower() in diagnosis_text.lower():
+    text_lower = diagnosis_text.lower()
+    for name_lower, _, condition in get_knowledge_base_index():
+        if name_lower in text_lower:
             return condition["name"]
     return "Unknown Condition"
 
 def get_recommendations(condition_name: str) -> dict:
     """Get recommendations for a specific condition"""
-    for condition in MEDICAL_CONDITIONS:
-        if condition["name"] == condition_name:
-            return {
-                "medicines": condition["medicines"],
-                "exercises": condition["exercises"],
-                "diet": condition.get("diet", []),
-                "doctor_specialization": condition["doctor_specialization"],
-                "description": condition["description"],
-                "disclaimer": "⚠️ This is an AI-generated diagnosis. Please consult with a qualified healthcare professional for proper medical advice and treatment."
-            }
+    get_knowledge_base_index()
+    condition = CONDITIONS_BY_NAME.get(condition_name)
+    if condition:
+        return {
+            "medicines": condition["medicines"],
+            "exercises": condition["exercises"],
+            "diet": condition.get("diet", []),
+            "doctor_specialization": condition["doctor_specialization"],
+            "description": condition["description"],
+            "disclaimer": "⚠️ This is an AI-generated diagnosis. Please consult with a qualified healthcare professional for proper medical advice and treatment."
+        }
     
     return {
         "medicines": ["Consult a doctor for proper medication"],
@@ -514,43 +1948,98 @@ def get_recommendations(condition_name: str) -> dict:
         "disclaimer": "⚠️ This is an AI-generated diagnosis. Please consult with a qualified healthcare professional for proper medical advice and treatment."
     }
 
+def knowledge_base_medicine_suggestions(condition: dict) -> dict:
+    return {
+        "disease": condition["name"],
+        "medicines": condition["medicines"],
+        "description": condition["description"],
+        "doctor_specialization": condition["doctor_specialization"],
+        "disclaimer": "⚠️ This is for informational purposes only. Consult a healthcare professional before taking any medication."
+    }
+
+def knowledge_base_exercise_suggestions(condition: dict) -> dict:
+    return {
+        "condition": condition["name"],
+        "exercises": condition["exercises"],
+        "diet": condition.get("diet", []),
+        "description": condition["description"],
+        "disclaimer": "⚠️ Consult your doctor before starting any exercise program."
+    }
+
+def ai_medicine_suggestions(disease_name: str, suggestions: str) -> dict:
+    return {
+        "disease": disease_name,
+        "ai_suggestions": suggestions,
+        "disclaimer": "⚠️ AI-generated suggestions. Always consult a healthcare professional."
+    }
+
+def ai_exercise_suggestions(condition_name: str, suggestions: str) -> dict:
+    return {
+        "condition": condition_name,
+        "ai_suggestions": suggestions,
+        "disclaimer": "⚠️ AI-generated suggestions. Consult healthcare professionals before making changes."
+    }
+
+async def get_batched_ai_suggestions(conditions: List[str], include: List[str]) -> dict:
+    """Ask Gemini for suggestions for several conditions at once; returns {condition: {kind: text}}"""
+    wanted = []
+    if "medicines" in include:
+        wanted.append('"medicines": common over-the-counter medicine suggestions with dosages and precautions')
+    if "exercises" in include:
+        wanted.append('"exercises": safe exercise recommendations and dietary guidelines')
+    condition_lines = "\n".join(f"- {name}" for name in conditions)
+    
+    response = await send_llm_message(
+        "You are a medical expert providing medicine, exercise and diet suggestions for medical conditions.",
+        "For each condition below, provide:\n" + "\n".join(wanted) +
+        f"\n\nConditions:\n{condition_lines}\n\n"
+        "Reply with a single JSON object keyed by the exact condition names above, each value an object with the requested keys as plain-text strings.",
+        purpose="batch_suggestions",
+        max_tokens=600 * len(conditions)
+    )
+    suggestions = extract_json_object(response)
+    # Match keys case-insensitively in case the model normalised capitalisation
+    by_lower = {str(key).lower(): value for key, value in suggestions.items()}
+    return {name: by_lower.get(name.lower()) for name in conditions}
+
 def find_condition_by_name(name: str) -> dict:
     """Find condition by name (case insensitive)"""
     name_lower = name.lower()
-    for condition in MEDICAL_CONDITIONS:
-        if name_lower in condition["name"].lower() or condition["name"].lower() in name_lower:
+    for condition_lower, symptoms_lower, condition in get_knowledge_base_index():
+        if name_lower in condition_lower or condition_lower in name_lower:
             return condition
         # Check symptoms too
-        for symptom in condition["symptoms"]:
-            if name_lower in symptom.lower():
+        for symptom in symptoms_lower:
+            if name_lower in symptom:
                 return condition
     return None
 
 async def get_document_recommendations(text: str) -> dict:
     """Get AI-powered recommendations based on document analysis"""
     try:
-        chat = LlmChat(
-            api_key=GEMINI_API_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message="You are a medical advisor providing recommendations based on medical reports."
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        message = UserMessage(
-            text=f"Based on this medical report, provide recommendations for: 1) Lifestyle changes 2) Diet modifications 3) Exercise suggestions 4) Follow-up care. Report: {text}"
+        response = await send_llm_message(
+            "You are a medical advisor providing recommendations based on medical reports.",
+            f"Based on this medical report, provide recommendations for: 1) Lifestyle changes 2) Diet modifications 3) Exercise suggestions 4) Follow-up care. Report: {text}",
+            purpose="document_recommendations"
         )
         
-        response = await chat.send_message(message)
-        
         return {
             "ai_recommendations": response,
             "disclaimer": "⚠️ These are AI-generated recommendations based on document analysis. Always follow your doctor's advice."
         }
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return {
             "error": "Could not generate recommendations",
             "disclaimer": "⚠️ Please consult your healthcare provider for personalized recommendations."
         }
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Expose instrumentation in Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -561,6 +2050,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MINIMUM_BYTES, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_BYTES)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -569,6 +2064,117 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Startup warmup
+warmup_state = {"ready": False, "steps": {}}
+background_tasks = {}
+
+async def create_indexes():
+    await db.diagnosis_sessions.create_index("session_id", unique=True)
+    # Mongo's TTL monitor removes idle incomplete sessions; completed ones have expires_at cleared
+    await db.diagnosis_sessions.create_index("expires_at", expireAfterSeconds=0)
+    await db.diagnosis_sessions.create_index(
+        "completed_at", partialFilterExpression={"completed_at": {"$type": "date"}}
+    )
+    await db.diagnosis_sessions_archive.create_index("session_id", unique=True)
+    await db.medical_documents.create_index("document_id", unique=True)
+    # (time field, _id) serves the time-filtered export walk as well as plain time sorts
+    await db.diagnosis_sessions.create_index([("timestamp", 1), ("_id", 1)])
+    await db.diagnosis_sessions_archive.create_index([("completed_at", 1), ("_id", 1)])
+    await db.medical_documents.create_index([("uploaded_at", 1), ("_id", 1)])
+    await db.medical_documents.create_index([("search_indexed_at", 1), ("_id", 1)])
+    await db.document_blobs.create_index([("document_id", 1), ("field", 1), ("n", 1)], unique=True)
+    await db.document_search.create_index("document_id", unique=True)
+    await db.document_search.create_index(
+        [("conditions", "text"), ("medicines", "text"), ("analysis_terms", "text"), ("filename", "text"), ("body", "text")],
+        weights={"conditions": 10, "medicines": 8, "analysis_terms": 3, "filename": 2, "body": 1},
+        default_language="english",
+        name="document_search_text"
+    )
+
+async def warm_llm_client():
+    """Build a client up front so provider SDK imports happen before traffic, optionally pinging Gemini"""
+    if WARMUP_LLM_PING:
+        await send_llm_message("Reply with OK.", "ping", purpose="warmup", max_tokens=5)
+    else:
+        LlmChat(api_key=GEMINI_API_KEY, session_id="warmup", system_message="warmup").with_model("gemini", "gemini-2.0-flash")
+
+async def run_warmup_step(name: str, step, required: bool = True) -> bool:
+    start = time.perf_counter()
+    try:
+        await step()
+        status = "ok"
+    except Exception as e:
+        status = "failed"
+        (logger.error if required else logger.warning)(f"Warmup step {name} failed: {str(e)}")
+    elapsed = time.perf_counter() - start
+    warmup_state["steps"][name] = {"status": status, "seconds": round(elapsed, 3)}
+    WARMUP_STEP_DURATION.set(elapsed, step=name, status=status)
+    return status == "ok" or not required
+
+async def run_backfill(name: str, backfill):
+    """Upgrade records written by older versions in the background, after warmup has connected"""
+    try:
+        updated = await backfill()
+        if updated:
+            logger.info(f"Backfill {name} updated {updated} records")
+    except Exception as e:
+        logger.error(f"Backfill {name} failed: {str(e)}")
+
+async def run_required_warmup_step(name: str, step):
+    """Retry a required step until it succeeds, e.g. when Mongo comes up after this pod"""
+    delay = WARMUP_RETRY_INITIAL_SECONDS
+    attempts = 1
+    while not await run_warmup_step(name, step):
+        warmup_state["steps"][name]["attempts"] = attempts
+        logger.info(f"Retrying warmup step {name} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+        attempts += 1
+    warmup_state["steps"][name]["attempts"] = attempts
+
+async def run_warmup():
+    """Connect, build indexes and load heavy dependencies before reporting ready"""
+    async def ping_mongo():
+        await client.admin.command("ping")
+    
+    async def compile_kb():
+        compile_knowledge_base()
+    
+    async def load_ocr():
+        await asyncio.to_thread(DocumentProcessor.warmup)
+    
+    await run_required_warmup_step("mongo_connect", ping_mongo)
+    await run_required_warmup_step("mongo_indexes", create_indexes)
+    await run_required_warmup_step("knowledge_base", compile_kb)
+    if WARMUP_OCR:
+        await run_warmup_step("ocr_engine", load_ocr, required=False)
+    await run_warmup_step("llm_client", warm_llm_client, required=False)
+    
+    warmup_state["ready"] = True
+    warmup_state["startup_seconds"] = round(time.perf_counter() - STARTUP_STARTED_AT, 3)
+    STARTUP_DURATION.set(warmup_state["startup_seconds"])
+    READY.set(1)
+    logger.info(f"Warmup complete in {warmup_state['startup_seconds']}s")
+    
+    background_tasks["session_backfill"] = asyncio.create_task(run_backfill("session_lifecycle", backfill_session_lifecycle))
+    background_tasks["search_backfill"] = asyncio.create_task(run_backfill("document_search", backfill_search_index))
+
+@app.on_event("startup")
+async def start_warmup():
+    # Run in the background so the server can answer liveness/readiness probes meanwhile
+    READY.set(0)
+    background_tasks["warmup"] = asyncio.create_task(run_warmup())
+    if SESSION_COMPACTOR_ENABLED:
+        background_tasks["session_compactor"] = asyncio.create_task(run_session_compactor())
+
+@app.get("/api/ready", include_in_schema=False)
+async def get_readiness():
+    """Readiness probe: 503 until startup warmup has completed"""
+    body = {"ready": warmup_state["ready"], "steps": warmup_state["steps"], "startup_seconds": warmup_state.get("startup_seconds")}
+    return JSONResponse(body, status_code=200 if warmup_state["ready"] else 503)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks.values():
+        task.cancel()
     client.close()
\ No newline at end of file
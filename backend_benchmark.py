@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""Offline load test and benchmark for the Medical AI backend.
+
+Runs the FastAPI app in-process (no deployment, no Gemini, no MongoDB server):
+- MongoDB is replaced by mongomock-motor
+- LlmChat is replaced by FakeLlmChat with configurable latency and token-rate distributions
+- OCR can be replaced by a fixed-cost stand-in when tesseract is not installed
+
+Requests arrive open-loop (Poisson) at the target RPS using a weighted mix of diagnosis
+turns, document uploads and catalog reads. The report lists p50/p95/p99 latency and
+throughput per endpoint and can be compared against a stored baseline.
+
+Usage:
+    pip install -r backend/requirements-dev.txt
+    python backend_benchmark.py --rps 20 --duration 30
+    python backend_benchmark.py --save-baseline
+    python backend_benchmark.py --compare tests/benchmark_baseline.json --tolerance 0.2
+    python backend_benchmark.py --storage --storage-sizes 10,100,1000,5000
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import time
+import types
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+DEFAULT_BASELINE = ROOT_DIR / 'tests' / 'benchmark_baseline.json'
+
+# Request mix: endpoint label -> relative weight
+DEFAULT_MIX = {
+    "start_diagnosis": 0.10,
+    "answer_question": 0.40,
+    "upload_document": 0.05,
+    "conditions": 0.20,
+    "medicine_suggestions": 0.15,
+    "exercise_suggestions": 0.10,
+    "batch_suggestions": 0.05,
+}
+
+KNOWN_CONDITIONS = ["cold", "migraine", "asthma", "diabetes", "arthritis", "hypertension"]
+UNKNOWN_CONDITIONS = ["rare tropical fever", "chronic fatigue syndrome", "plantar fasciitis"]
+
+
+class FakeLlmSettings:
+    """Latency model: lognormal time-to-first-token plus completion tokens at a normal token rate"""
+    latency_median = 0.4
+    latency_sigma = 0.5
+    tokens_per_second = 80.0
+    tokens_per_second_stddev = 20.0
+    completion_tokens = 150
+    diagnosis_confidence_step = 0.2
+
+
+class FakeUserMessage:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeLlmChat:
+    """Drop-in stand-in for emergentintegrations' LlmChat"""
+
+    def __init__(self, api_key: str, session_id: str, system_message: str):
+        self.session_id = session_id
+        self.system_message = system_message
+        self.max_tokens = None
+
+    def with_model(self, provider: str, model: str):
+        return self
+
+    def with_max_tokens(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        return self
+
+    def reply_for(self, text: str) -> str:
+        if '"conditions"' in self.system_message:
+            # Structured diagnosis turn whose confidence rises with each answered question
+            turns = text.count("\nA: ")
+            probability = min(0.3 + FakeLlmSettings.diagnosis_confidence_step * turns, 0.95)
+            return json.dumps({
+                "type": "question",
+                "question": f"Have you had this symptom for more than {turns + 1} days?",
+                "conditions": [
+                    {"name": "Migraine", "probability": round(probability, 2)},
+                    {"name": "Common Cold", "probability": round((1 - probability) / 2, 2)},
+                ],
+            })
+        if "exact condition names" in text:
+            # Batched suggestion prompt: answer every listed condition
+            names = [line[2:].strip() for line in text.splitlines() if line.startswith("- ")]
+            advice = {"medicines": "Acetaminophen 500mg as needed.", "exercises": "Gentle walking and hydration."}
+            return json.dumps({name: advice for name in names})
+        words = max(int(FakeLlmSettings.completion_tokens * 0.75), 1)
+        return " ".join(random.choice(["rest", "hydration", "follow-up", "exercise", "diet"]) for _ in range(words))
+
+    async def send_message(self, message: FakeUserMessage) -> str:
+        reply = self.reply_for(message.text)
+        tokens = len(reply) / 4
+        if self.max_tokens:
+            tokens = min(tokens, self.max_tokens)
+        rate = max(random.gauss(FakeLlmSettings.tokens_per_second, FakeLlmSettings.tokens_per_second_stddev), 1.0)
+        delay = random.lognormvariate(math.log(FakeLlmSettings.latency_median), FakeLlmSettings.latency_sigma) + tokens / rate
+        await asyncio.sleep(delay)
+        return reply
+
+
+def install_fake_llm():
+    """Register FakeLlmChat under the emergentintegrations import path before the server loads"""
+    package = types.ModuleType("emergentintegrations")
+    llm = types.ModuleType("emergentintegrations.llm")
+    chat = types.ModuleType("emergentintegrations.llm.chat")
+    chat.LlmChat = FakeLlmChat
+    chat.UserMessage = FakeUserMessage
+    package.llm = llm
+    llm.chat = chat
+    sys.modules.update({
+        "emergentintegrations": package,
+        "emergentintegrations.llm": llm,
+        "emergentintegrations.llm.chat": chat,
+    })
+
+
+def install_fake_ocr(page_seconds: float):
+    """Replace tesseract with a fixed per-page cost so uploads run without the binary"""
+    import pytesseract
+
+    def image_to_string(image, lang='eng', **kwargs):
+        time.sleep(page_seconds)
+        return "Diagnosis: Type 2 Diabetes Mellitus\nBlood Glucose: 180 mg/dL\nMetformin 500mg twice daily"
+
+    pytesseract.image_to_string = image_to_string
+
+
+def load_app(fake_ocr_ms: float):
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ.setdefault('DB_NAME', 'benchmark')
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    install_fake_llm()
+    if fake_ocr_ms >= 0:
+        install_fake_ocr(fake_ocr_ms / 1000.0)
+
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("mongomock-motor is required: pip install -r backend/requirements-dev.txt")
+
+    sys.path.insert(0, str(ROOT_DIR / 'backend'))
+    import server
+
+    server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ['DB_NAME']]
+    return server
+
+
+def sample_image_bytes() -> bytes:
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (800, 400), 'white')
+    draw = ImageDraw.Draw(image)
+    lines = ["MEDICAL REPORT", "Diagnosis: Type 2 Diabetes Mellitus", "HbA1c: 7.8% (High)", "Metformin 500mg twice daily"]
+    for i, line in enumerate(lines):
+        draw.text((20, 20 + i * 40), line, fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def synthetic_ocr_text(size_kb: int) -> str:
+    """OCR-like report text: repeated headings and labels with varying values, roughly size_kb long"""
+    labels = ["Blood Glucose", "HbA1c", "Cholesterol", "Hemoglobin", "WBC Count", "Platelets", "Creatinine", "TSH"]
+    units = ["mg/dL", "%", "g/dL", "x10^9/L", "mIU/L"]
+    lines = []
+    length = 0
+    page = 1
+    while length < size_kb * 1024:
+        if len(lines) % 40 == 0:
+            lines.append(f"--- Page {page} ---\nMEDICAL REPORT  Patient ID: {random.randint(10000, 99999)}")
+            page += 1
+        line = f"{random.choice(labels)}: {random.uniform(0.5, 250):.1f} {random.choice(units)} ({random.choice(['Normal', 'High', 'Low'])})"
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class LoadGenerator:
+    def __init__(self, http, mix: dict, max_in_flight: int):
+        self.http = http
+        self.endpoints = list(mix)
+        self.weights = [mix[name] for name in self.endpoints]
+        self.limit = asyncio.Semaphore(max_in_flight)
+        self.open_sessions = []
+        self.latencies = {name: [] for name in self.endpoints}
+        self.errors = {name: 0 for name in self.endpoints}
+        self.dropped = 0
+        self.image = sample_image_bytes()
+
+    async def start_diagnosis(self):
+        response = await self.http.post("/api/start-diagnosis")
+        if response.status_code == 200:
+            self.open_sessions.append(response.json()["session_id"])
+        return response
+
+    async def answer_question(self):
+        if not self.open_sessions:
+            return await self.start_diagnosis()
+        session_id = random.choice(self.open_sessions)
+        response = await self.http.post("/api/answer-question", json={"session_id": session_id, "answer": random.choice(["yes", "no", "maybe"])})
+        if response.status_code == 200 and response.json().get("is_complete") and session_id in self.open_sessions:
+            self.open_sessions.remove(session_id)
+        return response
+
+    async def upload_document(self):
+        files = {"file": ("report.png", self.image, "image/png")}
+        return await self.http.post("/api/upload-medical-document", files=files)
+
+    async def conditions(self):
+        return await self.http.get("/api/conditions")
+
+    async def medicine_suggestions(self):
+        name = random.choice(KNOWN_CONDITIONS * 3 + UNKNOWN_CONDITIONS)
+        return await self.http.post("/api/get-medicine-suggestions", json={"disease_name": name})
+
+    async def exercise_suggestions(self):
+        name = random.choice(KNOWN_CONDITIONS * 3 + UNKNOWN_CONDITIONS)
+        return await self.http.post("/api/get-exercise-suggestions", json={"condition": name})
+
+    async def batch_suggestions(self):
+        names = random.sample(KNOWN_CONDITIONS, 4) + random.sample(UNKNOWN_CONDITIONS, 2)
+        return await self.http.post("/api/get-batch-suggestions", json={"conditions": names})
+
+    async def issue(self, endpoint: str):
+        try:
+            start = time.perf_counter()
+            response = await getattr(self, endpoint)()
+            elapsed = time.perf_counter() - start
+            if response.status_code >= 400:
+                self.errors[endpoint] += 1
+            else:
+                self.latencies[endpoint].append(elapsed)
+        except Exception:
+            self.errors[endpoint] += 1
+        finally:
+            self.limit.release()
+
+    async def run(self, rps: float, duration: float) -> float:
+        tasks = []
+        start = time.perf_counter()
+        next_arrival = start
+        while next_arrival - start < duration:
+            await asyncio.sleep(max(next_arrival - time.perf_counter(), 0))
+            endpoint = random.choices(self.endpoints, self.weights)[0]
+            if self.limit.locked():
+                # Open-loop: never queue client-side, count the arrival as dropped instead
+                self.dropped += 1
+            else:
+                await self.limit.acquire()
+                tasks.append(asyncio.create_task(self.issue(endpoint)))
+            next_arrival += random.expovariate(rps)
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> dict:
+        results = {}
+        for endpoint in self.endpoints:
+            values = sorted(self.latencies[endpoint])
+            results[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors[endpoint],
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            }
+        return results
+
+
+def print_report(results: dict, dropped: int):
+    print(f"\n{'endpoint':<24}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>8}")
+    for endpoint, row in results.items():
+        print(f"{endpoint:<24}{row['requests']:>10}{row['errors']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row['throughput_rps']:>8}")
+    if dropped:
+        print(f"\n⚠️ {dropped} arrivals dropped at the in-flight limit")
+
+
+def run_config(args, mix: dict) -> dict:
+    """Settings that change latency or throughput; results are only comparable when these match"""
+    return {
+        "rps": args.rps,
+        "duration": args.duration,
+        "max_in_flight": args.max_in_flight,
+        "mix": mix,
+        "seed": args.seed,
+        "llm_latency_ms": args.llm_latency_ms,
+        "llm_latency_sigma": args.llm_latency_sigma,
+        "llm_tokens_per_second": args.llm_tokens_per_second,
+        "llm_completion_tokens": args.llm_completion_tokens,
+        "fake_ocr_ms": args.fake_ocr_ms,
+    }
+
+
+def config_mismatches(config: dict, baseline: dict) -> list:
+    """Return the run settings that differ from the ones the baseline was recorded with"""
+    reference = baseline.get("config")
+    if reference is None:
+        return ["baseline has no run config; regenerate it with --save-baseline"]
+    return [
+        f"{key}: {config.get(key)!r} vs baseline {reference.get(key)!r}"
+        for key in sorted(set(config) | set(reference))
+        if config.get(key) != reference.get(key)
+    ]
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return regressions where p95/p99 grew or throughput fell beyond the tolerance.
+
+    Endpoints the baseline doesn't cover, or that completed no requests, count as regressions
+    so nothing in the mix goes unguarded.
+    """
+    regressions = []
+    baseline_results = baseline["results"]
+    for endpoint, row in results.items():
+        reference = baseline_results.get(endpoint)
+        if not reference:
+            regressions.append(f"{endpoint}: missing from baseline; regenerate it with --save-baseline")
+            continue
+        if not row["requests"]:
+            regressions.append(f"{endpoint}: no successful requests (baseline {reference['requests']})")
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if reference[key] and row[key] > reference[key] * (1 + tolerance):
+                regressions.append(f"{endpoint} {key}: {row[key]} vs baseline {reference[key]}")
+        if reference["throughput_rps"] and row["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{endpoint} throughput_rps: {row['throughput_rps']} vs baseline {reference['throughput_rps']}")
+        if row["errors"] > reference.get("errors", 0):
+            regressions.append(f"{endpoint} errors: {row['errors']} vs baseline {reference.get('errors', 0)}")
+    return regressions
+
+
+def build_mix(args) -> dict:
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix.update(json.loads(args.mix))
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+async def run_benchmark(args) -> dict:
+    import httpx
+
+    server = load_app(args.fake_ocr_ms)
+    mix = build_mix(args)
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as http:
+        generator = LoadGenerator(http, mix, args.max_in_flight)
+        print(f"Running {args.duration}s at {args.rps} RPS (mix: {mix})")
+        elapsed = await generator.run(args.rps, args.duration)
+    results = generator.report(elapsed)
+    print_report(results, generator.dropped)
+    return results
+
+
+async def run_storage_benchmark(args) -> dict:
+    """Measure compression ratio and metadata vs full-text read latency of document storage"""
+    server = load_app(args.fake_ocr_ms)
+    sizes = [int(size) for size in args.storage_sizes.split(",")]
+    results = {}
+    print(f"\n{'text KB':>8}{'stored KB':>11}{'ratio':>8}{'location':>10}{'meta p50 ms':>13}{'meta p95 ms':>13}{'text p50 ms':>13}{'text p95 ms':>13}")
+    for size_kb in sizes:
+        text = synthetic_ocr_text(size_kb)
+        document_ids = []
+        for i in range(args.storage_documents):
+            document_id = f"bench-{size_kb}-{i}"
+            stored = await server.store_medical_document(
+                {"document_id": document_id, "filename": f"{document_id}.pdf", "file_type": "application/pdf", "uploaded_at": server.datetime.utcnow()},
+                {"extracted_text": text, "analysis": {"analysis": "summary"}, "recommendations": {"ai_recommendations": "advice"}}
+            )
+            document_ids.append(document_id)
+        descriptor = stored["content"]["extracted_text"]
+
+        timings = {"meta": [], "text": []}
+        for document_id in document_ids:
+            start = time.perf_counter()
+            await server.get_document(document_id)
+            timings["meta"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            await server.get_document(document_id, ("extracted_text",))
+            timings["text"].append(time.perf_counter() - start)
+
+        meta, full = sorted(timings["meta"]), sorted(timings["text"])
+        row = {
+            "text_kb": round(descriptor["size"] / 1024, 1),
+            "stored_kb": round(descriptor["compressed_size"] / 1024, 1),
+            "compression_ratio": round(descriptor["size"] / descriptor["compressed_size"], 2),
+            "location": descriptor["location"],
+            "metadata_p50_ms": round(percentile(meta, 0.50) * 1000, 3),
+            "metadata_p95_ms": round(percentile(meta, 0.95) * 1000, 3),
+            "text_p50_ms": round(percentile(full, 0.50) * 1000, 3),
+            "text_p95_ms": round(percentile(full, 0.95) * 1000, 3),
+        }
+        results[f"{size_kb}kb"] = row
+        print(f"{row['text_kb']:>8}{row['stored_kb']:>11}{row['compression_ratio']:>8}{row['location']:>10}"
+              f"{row['metadata_p50_ms']:>13}{row['metadata_p95_ms']:>13}{row['text_p50_ms']:>13}{row['text_p95_ms']:>13}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the Medical AI backend")
+    parser.add_argument("--rps", type=float, default=20.0, help="target request arrival rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load to generate")
+    parser.add_argument("--max-in-flight", type=int, default=200, help="cap on concurrent requests")
+    parser.add_argument("--mix", help='JSON weights overriding the default mix, e.g. \'{"upload_document": 0.2}\'')
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--llm-latency-ms", type=float, default=FakeLlmSettings.latency_median * 1000, help="median LLM time to first token")
+    parser.add_argument("--llm-latency-sigma", type=float, default=FakeLlmSettings.latency_sigma, help="lognormal sigma of LLM latency")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=FakeLlmSettings.tokens_per_second)
+    parser.add_argument("--llm-completion-tokens", type=int, default=FakeLlmSettings.completion_tokens)
+    parser.add_argument("--fake-ocr-ms", type=float, default=None, help="per-page OCR cost; defaults to 300 when tesseract is missing, -1 uses real OCR")
+    parser.add_argument("--compare", type=Path, help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, type=Path, help="store results as the new baseline")
+    parser.add_argument("--output", type=Path, help="write results JSON to this path")
+    parser.add_argument("--storage", action="store_true", help="benchmark document storage instead of HTTP load")
+    parser.add_argument("--storage-sizes", default="10,100,1000,5000", help="comma-separated extracted text sizes in KB")
+    parser.add_argument("--storage-documents", type=int, default=20, help="documents stored and read per size")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    FakeLlmSettings.latency_median = args.llm_latency_ms / 1000.0
+    FakeLlmSettings.latency_sigma = args.llm_latency_sigma
+    FakeLlmSettings.tokens_per_second = args.llm_tokens_per_second
+    FakeLlmSettings.completion_tokens = args.llm_completion_tokens
+    if args.fake_ocr_ms is None:
+        args.fake_ocr_ms = -1 if shutil.which("tesseract") else 300.0
+
+    if args.storage:
+        results = asyncio.run(run_storage_benchmark(args))
+        if args.output:
+            args.output.write_text(json.dumps(results, indent=2))
+        return
+
+    config = run_config(args, build_mix(args))
+    baseline = None
+    if args.compare:
+        # Check settings before spending the run: throughput scales with --rps, latency with the fakes
+        baseline = json.loads(args.compare.read_text())
+        mismatches = config_mismatches(config, baseline)
+        if mismatches:
+            print("❌ Run settings differ from the baseline, results would not be comparable:")
+            for mismatch in mismatches:
+                print(f"  - {mismatch}")
+            sys.exit(2)
+
+    results = asyncio.run(run_benchmark(args))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps({"config": config, "results": results}, indent=2) + "\n")
+        print(f"\n✅ Baseline saved to {args.save_baseline}")
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ Performance regressions:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("\n✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -358,6 +358,59 @@ class MedicalDiagnosisBackendTest(unittest.TestCase):
             # Don't fail the entire test suite if this test has issues
             print("⚠️ OCR document processing test encountered issues but continuing with other tests")
 
+    def test_10_diagnosis_stats(self):
+        """Test the /diagnosis-stats endpoint reports LLM calls per completed session"""
+        print("\n=== Testing Diagnosis Stats Endpoint ===")
+        response = requests.get(f"{API_URL}/diagnosis-stats")
+        
+        self.assertEqual(response.status_code, 200, "Failed to get diagnosis stats")
+        
+        data = response.json()
+        self.assertIn("completed_sessions", data, "Stats should contain completed_sessions")
+        self.assertIn("avg_llm_calls_per_session", data, "Stats should contain avg_llm_calls_per_session")
+        self.assertIn("confidence_threshold", data, "Stats should contain confidence_threshold")
+        
+        print(f"Average LLM calls per completed session: {data['avg_llm_calls_per_session']}")
+        print("✅ Diagnosis stats test passed")
+
+    def test_11_readiness(self):
+        """Test the /ready endpoint reports completed startup warmup"""
+        print("\n=== Testing Readiness Endpoint ===")
+        response = requests.get(f"{API_URL}/ready")
+        
+        self.assertEqual(response.status_code, 200, "Backend should be ready after warmup")
+        
+        data = response.json()
+        self.assertTrue(data["ready"], "Readiness should be true")
+        self.assertIn("steps", data, "Readiness should list warmup steps")
+        
+        print(f"Startup took {data['startup_seconds']}s")
+        print("✅ Readiness test passed")
+
+    def test_12_batch_suggestions(self):
+        """Test batched medicine and exercise suggestions for several conditions"""
+        print("\n=== Testing Batch Suggestions Endpoint ===")
+        conditions = ["diabetes", "migraine", "rare tropical fever"]
+        response = requests.post(
+            f"{API_URL}/get-batch-suggestions",
+            json={"conditions": conditions}
+        )
+        
+        self.assertEqual(response.status_code, 200, "Failed to get batch suggestions")
+        
+        data = response.json()
+        self.assertIn("results", data, "Response should contain results")
+        for condition in conditions:
+            self.assertIn(condition, data["results"], f"Results should be keyed by {condition}")
+        
+        self.assertEqual(data["results"]["diabetes"]["source"], "knowledge_base", "Known conditions should come from the knowledge base")
+        self.assertIn("medicine", data["results"]["diabetes"], "Known condition should include medicine suggestions")
+        self.assertIn("exercise", data["results"]["diabetes"], "Known condition should include exercise suggestions")
+        self.assertEqual(data["results"]["rare tropical fever"]["source"], "ai", "Unknown conditions should use AI")
+        
+        print(f"LLM calls for {len(conditions)} conditions: {data['llm_calls']}")
+        print("✅ Batch suggestions test passed")
+
 def run_tests():
     """Run all tests in sequence"""
     test_suite = unittest.TestSuite()
@@ -370,6 +423,9 @@ def run_tests():
     test_suite.addTest(MedicalDiagnosisBackendTest('test_07_medicine_suggestion_system'))
     test_suite.addTest(MedicalDiagnosisBackendTest('test_08_exercise_diet_recommendation_system'))
     test_suite.addTest(MedicalDiagnosisBackendTest('test_09_ocr_document_processing'))
+    test_suite.addTest(MedicalDiagnosisBackendTest('test_10_diagnosis_stats'))
+    test_suite.addTest(MedicalDiagnosisBackendTest('test_11_readiness'))
+    test_suite.addTest(MedicalDiagnosisBackendTest('test_12_batch_suggestions'))
     
     runner = unittest.TextTestRunner(verbosity=2)
     runner.run(test_suite)
@@ -0,0 +1,62 @@
+"""Shared fixtures for the offline backend unit tests.
+
+The server module is imported with the benchmark's FakeLlmChat standing in for Gemini, and
+each test that touches the database gets a fresh mongomock-motor database:
+
+    pip install -r backend/requirements-dev.txt
+    python -m pytest
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent.parent
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'unit_tests')
+os.environ.setdefault('GEMINI_API_KEY', 'unit-tests')
+os.environ.setdefault('WARMUP_OCR', 'false')
+os.environ.setdefault('SESSION_COMPACTOR_ENABLED', 'false')
+
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(ROOT_DIR / 'backend'))
+
+from backend_benchmark import install_fake_llm  # noqa: E402
+
+install_fake_llm()
+
+
+@pytest.fixture(scope="session")
+def server():
+    import server as server_module
+    return server_module
+
+
+def accept_bulk_sort(method):
+    """Newer pymongo passes sort= to bulk update/replace operations, which mongomock doesn't accept yet"""
+    def wrapper(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+@pytest.fixture
+def db(server, monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from mongomock.collection import BulkOperationBuilder
+    for name in ("add_update", "add_replace"):
+        monkeypatch.setattr(BulkOperationBuilder, name, accept_bulk_sort(getattr(BulkOperationBuilder, name)))
+    # mongomock-motor's with_options returns a synchronous collection; read preferences don't matter here
+    monkeypatch.setattr(mongomock_motor.AsyncMongoMockCollection, "with_options", lambda self, **kwargs: self, raising=False)
+    client = mongomock_motor.AsyncMongoMockClient()
+    database = client[os.environ['DB_NAME']]
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def run(coroutine):
+    """Run a coroutine to completion on a fresh event loop"""
+    return asyncio.run(coroutine)
@@ -0,0 +1,28 @@
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "s3cret")
+    return TestClient(server.app)
+
+
+def test_admin_token_checks(server, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "s3cret")
+    assert server.is_admin_token("s3cret")
+    assert not server.is_admin_token("wrong")
+    assert not server.is_admin_token(None)
+    assert not server.is_admin_token("sécret")
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "")
+    assert not server.is_admin_token("")
+
+
+def test_non_ascii_admin_token_is_rejected(client):
+    response = client.get("/api/admin/profiles", headers={"X-Admin-Token": "sécret".encode()})
+    assert response.status_code == 403
+
+
+def test_non_ascii_profile_header_is_ignored(client):
+    response = client.get("/api/conditions", headers={"X-Profile-Request": "sécret".encode()})
+    assert response.status_code == 200
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(server, db):
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def prompts(server, monkeypatch):
+    """Answer batched prompts for every listed condition, failing any prompt that mentions "broken" """
+    seen = []
+
+    async def fake_send(system_message, text, purpose, session_id=None, max_tokens=None):
+        names = [line[2:] for line in text.split("Conditions:\n", 1)[1].split("\n\n", 1)[0].splitlines()]
+        seen.append(names)
+        if any("broken" in name for name in names):
+            raise RuntimeError("model overloaded")
+        # Keys come back upper-cased to check they are matched case-insensitively
+        return json.dumps({name.upper(): {"medicines": f"rest for {name}", "exercises": f"walk for {name}"} for name in names})
+
+    monkeypatch.setattr(server, "send_llm_message", fake_send)
+    return seen
+
+
+def test_knowledge_base_hits_skip_the_llm(server, client, prompts):
+    response = client.post("/api/get-batch-suggestions", json={"conditions": ["Migraine", "zeta fever", "MIGRAINE "]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["llm_calls"] == 1
+    assert prompts == [["zeta fever"]]
+    assert list(body["results"]) == ["Migraine", "zeta fever"]
+
+    hit = body["results"]["Migraine"]
+    assert hit["source"] == "knowledge_base"
+    assert hit["medicine"]["disease"] == "Migraine"
+    assert "exercise" in hit
+
+    miss = body["results"]["zeta fever"]
+    assert miss["source"] == "ai"
+    assert miss["medicine"]["ai_suggestions"] == "rest for zeta fever"
+    assert miss["exercise"]["ai_suggestions"] == "walk for zeta fever"
+
+
+def test_include_limits_the_suggestion_kinds(server, client, prompts):
+    response = client.post("/api/get-batch-suggestions", json={"conditions": ["zeta fever"], "include": ["exercises"]})
+    result = response.json()["results"]["zeta fever"]
+    assert "medicine" not in result
+    assert result["exercise"]["ai_suggestions"] == "walk for zeta fever"
+
+
+def test_a_failed_group_only_errors_its_own_conditions(server, client, prompts, monkeypatch):
+    monkeypatch.setattr(server, "BATCH_SUGGESTION_GROUP_SIZE", 1)
+    response = client.post("/api/get-batch-suggestions", json={"conditions": ["zeta fever", "broken pox"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["llm_calls"] == 2
+    assert body["results"]["zeta fever"]["medicine"]["ai_suggestions"] == "rest for zeta fever"
+    assert body["results"]["broken pox"] == {"source": "ai", "error": "Could not generate suggestions for this condition"}
+
+
+@pytest.mark.parametrize("body", [
+    {"conditions": []},
+    {"conditions": ["  ", ""]},
+    {"conditions": ["zeta fever"], "include": []},
+])
+def test_requests_with_nothing_to_suggest_are_rejected(server, client, prompts, body):
+    assert client.post("/api/get-batch-suggestions", json=body).status_code == 400
+    assert prompts == []
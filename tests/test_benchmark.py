@@ -0,0 +1,48 @@
+import argparse
+
+import backend_benchmark
+
+
+def row(**overrides):
+    values = {"requests": 100, "errors": 0, "p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": 30.0, "throughput_rps": 5.0}
+    values.update(overrides)
+    return values
+
+
+def config(**overrides):
+    args = argparse.Namespace(
+        rps=20.0, duration=30.0, max_in_flight=200, seed=42, llm_latency_ms=400.0, llm_latency_sigma=0.5,
+        llm_tokens_per_second=80.0, llm_completion_tokens=150, fake_ocr_ms=300.0
+    )
+    for key, value in overrides.items():
+        setattr(args, key, value)
+    return backend_benchmark.run_config(args, {"conditions": 1.0})
+
+
+def test_matching_run_has_no_regressions():
+    baseline = {"config": config(), "results": {"conditions": row()}}
+    assert backend_benchmark.config_mismatches(config(), baseline) == []
+    assert backend_benchmark.compare_to_baseline({"conditions": row(p95_ms=22.0)}, baseline, 0.2) == []
+
+
+def test_different_settings_are_not_comparable():
+    baseline = {"config": config(), "results": {}}
+    mismatches = backend_benchmark.config_mismatches(config(rps=10.0), baseline)
+    assert mismatches == ["rps: 10.0 vs baseline 20.0"]
+
+
+def test_baseline_without_config_is_rejected():
+    assert backend_benchmark.config_mismatches(config(), {"conditions": row()})
+
+
+def test_regressions_and_missing_endpoints_are_reported():
+    baseline = {"config": config(), "results": {"conditions": row(), "idle": row()}}
+    results = {
+        "conditions": row(p99_ms=100.0, throughput_rps=1.0, errors=2),
+        "idle": row(requests=0),
+        "batch_suggestions": row(),
+    }
+    regressions = backend_benchmark.compare_to_baseline(results, baseline, 0.2)
+    assert len(regressions) == 5
+    assert any(r.startswith("batch_suggestions: missing from baseline") for r in regressions)
+    assert any(r.startswith("idle: no successful requests") for r in regressions)
@@ -0,0 +1,150 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from tests.conftest import run
+
+
+def fake_request(timeout=None, disconnect_after=None):
+    loop_time = {}
+
+    async def is_disconnected():
+        started = loop_time.setdefault("start", asyncio.get_running_loop().time())
+        return disconnect_after is not None and asyncio.get_running_loop().time() - started >= disconnect_after
+
+    headers = {"x-request-timeout": str(timeout)} if timeout is not None else {}
+    return SimpleNamespace(headers=headers, is_disconnected=is_disconnected)
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(server, monkeypatch):
+    monkeypatch.setattr(server, "DISCONNECT_POLL_SECONDS", 0.01)
+
+
+def cancelled_requests(server, endpoint, reason):
+    return server.CANCELLED_REQUESTS._values.get((endpoint, reason), 0.0)
+
+
+def test_work_sees_the_request_deadline(server):
+    async def work():
+        return server.remaining_time()
+
+    remaining = run(server.run_cancellable(fake_request(timeout=5), work(), "test"))
+    assert 0 < remaining <= 5
+
+
+def test_deadline_cancels_work_with_504(server):
+    state = {}
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    before = cancelled_requests(server, "test_deadline", "deadline")
+    with pytest.raises(HTTPException) as error:
+        run(server.run_cancellable(fake_request(timeout=0.05), work(), "test_deadline"))
+    assert error.value.status_code == 504
+    assert state["cancelled"]
+    assert cancelled_requests(server, "test_deadline", "deadline") == before + 1
+
+
+def test_deadline_exceeded_inside_work_maps_to_504(server):
+    async def work():
+        await asyncio.sleep(0.05)
+        server.check_deadline("test_step")
+
+    with pytest.raises(HTTPException) as error:
+        run(server.run_cancellable(fake_request(timeout=0.01), work(), "test_inner_deadline"))
+    assert error.value.status_code == 504
+
+
+def test_client_disconnect_cancels_work_with_499(server):
+    state = {}
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    before = cancelled_requests(server, "test_disconnect", "client_disconnect")
+    with pytest.raises(HTTPException) as error:
+        run(server.run_cancellable(fake_request(disconnect_after=0.03), work(), "test_disconnect"))
+    assert error.value.status_code == 499
+    assert state["cancelled"]
+    assert cancelled_requests(server, "test_disconnect", "client_disconnect") == before + 1
+
+
+def test_batch_suggestions_llm_calls_inherit_the_deadline(server, db, monkeypatch):
+    seen = []
+
+    async def spy(system_message, text, purpose, session_id=None, max_tokens=None):
+        seen.append(server.remaining_time())
+        if len(seen) > 1:
+            await asyncio.sleep(10)
+        return "{}"
+
+    monkeypatch.setattr(server, "send_llm_message", spy)
+    monkeypatch.setattr(server, "BATCH_SUGGESTION_GROUP_SIZE", 1)
+    client = TestClient(server.app)
+    body = {"conditions": ["zeta fever"], "include": ["medicines"]}
+    response = client.post("/api/get-batch-suggestions", json=body, headers={"X-Request-Timeout": "5"})
+    assert response.status_code == 200
+    assert seen[0] is not None and 0 < seen[0] <= 5
+
+    body = {"conditions": ["zeta fever", "omega pox"], "include": ["medicines"]}
+    response = client.post("/api/get-batch-suggestions", json=body, headers={"X-Request-Timeout": "0.2"})
+    assert response.status_code == 504
+
+
+def test_disconnect_during_document_write_still_completes_it(server, db, monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    monkeypatch.setattr(server, "DOCUMENT_INLINE_LIMIT_BYTES", 64)
+    monkeypatch.setattr(server, "DOCUMENT_BLOB_CHUNK_BYTES", 64)
+    text = " ".join(f"glucose {i * 7.31:.2f}" for i in range(200))
+
+    async def extract(content):
+        return text
+
+    async def analyze(extracted_text):
+        return {"analysis": "Type 2 diabetes"}
+
+    async def recommend(extracted_text):
+        return {"ai_recommendations": "Walk daily"}
+
+    insert_one = mongomock_motor.AsyncMongoMockCollection.insert_one
+
+    async def slow_insert_one(self, document, *args, **kwargs):
+        if self.name == "medical_documents":
+            await asyncio.sleep(0.1)  # Disconnect lands after the blob chunks, before the metadata
+        return await insert_one(self, document, *args, **kwargs)
+
+    monkeypatch.setattr(server.DocumentProcessor, "extract_text_from_image", extract)
+    monkeypatch.setattr(server, "analyze_medical_document", analyze)
+    monkeypatch.setattr(server, "get_document_recommendations", recommend)
+    monkeypatch.setattr(mongomock_motor.AsyncMongoMockCollection, "insert_one", slow_insert_one)
+
+    async def upload():
+        async def read():
+            return b"png"
+        upload_file = SimpleNamespace(content_type="image/png", filename="scan.png", read=read)
+        with pytest.raises(HTTPException) as error:
+            await server.run_cancellable(
+                fake_request(disconnect_after=0.03), server.process_medical_document(upload_file, "lean"), "test_upload"
+            )
+        assert error.value.status_code == 499
+        await asyncio.sleep(0.3)
+
+    run(upload())
+    document = run(db.medical_documents.find_one({}))
+    assert document is not None and document["search_indexed_at"] is not None
+    assert run(db.document_blobs.count_documents({"document_id": {"$ne": document["document_id"]}})) == 0
+    assert run(db.document_search.count_documents({"document_id": document["document_id"]})) == 1
+    assert run(server.get_document(document["document_id"], ("extracted_text",)))["extracted_text"] == text
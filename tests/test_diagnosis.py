@@ -0,0 +1,167 @@
+import json
+
+import pytest
+
+from tests.conftest import run
+
+
+def test_parse_structured_reply_sorts_conditions(server):
+    turn = server.parse_diagnosis_turn(json.dumps({
+        "type": "question",
+        "question": "Do you have a fever?",
+        "conditions": [{"name": "Common Cold", "probability": 0.2}, {"name": "Flu", "probability": 0.6}]
+    }))
+    assert turn.type == "question"
+    assert turn.question == "Do you have a fever?"
+    assert [c.name for c in turn.conditions] == ["Flu", "Common Cold"]
+
+
+def test_parse_converts_percentages_and_clamps(server):
+    turn = server.parse_diagnosis_turn(json.dumps({
+        "type": "diagnosis",
+        "diagnosis": "Migraine",
+        "conditions": [{"name": "Migraine", "probability": 85}, {"name": "Tension Headache", "probability": -0.5}]
+    }))
+    assert turn.diagnosis == "Migraine"
+    assert turn.conditions[0].probability == pytest.approx(0.85)
+    assert turn.conditions[1].probability == 0.0
+
+
+@pytest.mark.parametrize("reply", [
+    'Here is my answer:\n```json\n{"type": "question", "question": "Any nausea?", "conditions": []}\n```',
+    'Sure! {"type": "question", "question": "Any nausea?"} Let me know.',
+])
+def test_parse_extracts_json_from_prose_and_code_fences(server, reply):
+    turn = server.parse_diagnosis_turn(reply)
+    assert turn.question == "Any nausea?"
+    assert turn.conditions == []
+
+
+@pytest.mark.parametrize("reply", [
+    "Do you have a headache?",
+    '{"type": "banana", "question": "ignored"}',
+    '{"type": "question", "conditions": [{"probability": 0.4}]}',
+    '{"type": "question", "conditions": [{"name": "Flu", "probability": "high"}]}',
+    '{"type": "question", "conditions": "Flu"}',
+    '{"type": "question", "question": ',
+])
+def test_parse_falls_back_to_plain_question(server, reply):
+    turn = server.parse_diagnosis_turn(reply)
+    assert turn.type == "question"
+    assert turn.question == reply.strip()
+    assert turn.conditions == []
+
+
+def start_session(server, db, responses: int = 0) -> str:
+    session = server.DiagnosisSession(
+        current_question="Do you have a headache?",
+        user_responses=[f"Q: q{i}\nA: yes" for i in range(responses)],
+        expires_at=server.session_expiry()
+    )
+    run(db.diagnosis_sessions.insert_one(session.dict()))
+    return session.session_id
+
+
+def answer(server, monkeypatch, session_id: str, turn):
+    async def fake_turn(session_id, user_input, conversation_history):
+        return turn
+    monkeypatch.setattr(server, "get_diagnosis_turn", fake_turn)
+    return run(server.process_answer(server.UserResponse(session_id=session_id, answer="yes")))
+
+
+def ranked(server, *pairs):
+    return [server.RankedCondition(name=name, probability=probability) for name, probability in pairs]
+
+
+def test_continues_below_threshold(server, db, monkeypatch):
+    session_id = start_session(server, db)
+    turn = server.DiagnosisTurn(type="question", question="Any fever?", conditions=ranked(server, ("Migraine", 0.5)))
+    result = answer(server, monkeypatch, session_id, turn)
+    assert not result.is_complete
+    assert result.question == "Any fever?"
+    stored = run(db.diagnosis_sessions.find_one({"session_id": session_id}))
+    assert stored["current_question"] == "Any fever?"
+    assert stored["llm_calls"] == 1
+    assert stored["completed_at"] is None
+
+
+def test_stops_once_top_condition_clears_threshold(server, db, monkeypatch):
+    session_id = start_session(server, db)
+    probability = server.DIAGNOSIS_CONFIDENCE_THRESHOLD
+    turn = server.DiagnosisTurn(type="question", question="Any fever?", conditions=ranked(server, ("Migraine", probability)))
+    result = answer(server, monkeypatch, session_id, turn)
+    assert result.is_complete
+    assert result.question is None
+    assert result.potential_conditions == ["Migraine"]
+    assert "Migraine" in result.final_diagnosis
+    stored = run(db.diagnosis_sessions.find_one({"session_id": session_id}))
+    assert stored["completed_at"] is not None
+    assert stored["expires_at"] is None
+
+
+def test_stops_at_max_turns(server, db, monkeypatch):
+    session_id = start_session(server, db, responses=server.MAX_DIAGNOSIS_TURNS - 1)
+    turn = server.DiagnosisTurn(type="question", question="Any fever?", conditions=ranked(server, ("Migraine", 0.3)))
+    result = answer(server, monkeypatch, session_id, turn)
+    assert result.is_complete
+    assert result.final_diagnosis.startswith("Most likely condition: Migraine")
+
+
+def test_stops_when_no_question_is_returned(server, db, monkeypatch):
+    session_id = start_session(server, db)
+    turn = server.DiagnosisTurn(type="diagnosis", diagnosis="Tension headache", conditions=ranked(server, ("Migraine", 0.4)))
+    result = answer(server, monkeypatch, session_id, turn)
+    assert result.is_complete
+    assert result.final_diagnosis == "Tension headache"
+
+
+def test_unparseable_reply_keeps_previous_ranking(server, db, monkeypatch):
+    session_id = start_session(server, db)
+    turn = server.DiagnosisTurn(type="question", question="Any fever?", conditions=ranked(server, ("Migraine", 0.6), ("Flu", 0.2)))
+    answer(server, monkeypatch, session_id, turn)
+
+    result = answer(server, monkeypatch, session_id, server.parse_diagnosis_turn("Does light bother your eyes?"))
+    assert not result.is_complete
+    assert result.question == "Does light bother your eyes?"
+    assert result.confidence_score == 0.6
+    assert [c.name for c in result.ranked_conditions] == ["Migraine", "Flu"]
+
+
+def test_max_turns_with_unparseable_reply_uses_previous_top_condition(server, db, monkeypatch):
+    session_id = start_session(server, db, responses=server.MAX_DIAGNOSIS_TURNS - 2)
+    answer(server, monkeypatch, session_id, server.DiagnosisTurn(type="question", question="Any fever?", conditions=ranked(server, ("Migraine", 0.5))))
+    result = answer(server, monkeypatch, session_id, server.parse_diagnosis_turn("Anything else?"))
+    assert result.is_complete
+    assert result.final_diagnosis.startswith("Most likely condition: Migraine")
+
+
+def test_llm_error_is_surfaced_without_using_a_turn(server, db, monkeypatch):
+    session_id = start_session(server, db)
+
+    async def failing(*args, **kwargs):
+        raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(server, "send_llm_message", failing)
+    with pytest.raises(server.HTTPException) as error:
+        run(server.process_answer(server.UserResponse(session_id=session_id, answer="yes")))
+    assert error.value.status_code == 502
+    stored = run(db.diagnosis_sessions.find_one({"session_id": session_id}))
+    assert stored["user_responses"] == []
+    assert stored["current_question"] == "Do you have a headache?"
+
+
+def test_missing_session_is_404(server, db):
+    with pytest.raises(server.HTTPException) as error:
+        run(server.process_answer(server.UserResponse(session_id="missing", answer="yes")))
+    assert error.value.status_code == 404
+
+
+def test_start_falls_back_to_default_question_on_llm_error(server, db, monkeypatch):
+    async def failing(*args, **kwargs):
+        raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(server, "send_llm_message", failing)
+    result = run(server.begin_diagnosis())
+    assert result.question == "Are you currently experiencing any pain or discomfort?"
+    stored = run(db.diagnosis_sessions.find_one({"session_id": result.session_id}))
+    assert stored["current_question"] == result.question
@@ -0,0 +1,173 @@
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.conftest import run
+
+
+def report_text(size: int) -> str:
+    """Varied, non-ASCII text so compressed output spans several blob chunks"""
+    generator = random.Random(size)
+    words = ["glucose", "hémoglobine", "cholesterol", "血压", "normal", "high", "low", "mg/dL"]
+    text = ""
+    while len(text.encode("utf-8")) < size:
+        text += f"{generator.choice(words)} {generator.uniform(0, 500):.2f}\n"
+    return text
+
+
+@pytest.fixture
+def small_blobs(server, monkeypatch):
+    monkeypatch.setattr(server, "DOCUMENT_INLINE_LIMIT_BYTES", 512)
+    monkeypatch.setattr(server, "DOCUMENT_BLOB_CHUNK_BYTES", 256)
+
+
+def store(server, document_id: str, text: str) -> dict:
+    return run(server.store_medical_document(
+        {"document_id": document_id, "filename": f"{document_id}.pdf", "file_type": "application/pdf"},
+        {"extracted_text": text, "analysis": {"analysis": "Diagnosed: Migraine"}, "recommendations": {"ai_recommendations": "Rest"}}
+    ))
+
+
+def test_small_fields_are_stored_inline(server, db):
+    document = store(server, "inline", "Hemoglobin 13.5 g/dL")
+    descriptor = document["content"]["extracted_text"]
+    assert descriptor["location"] == "inline"
+    assert descriptor["encoding"] == "zlib+utf8"
+    assert document["content"]["analysis"]["encoding"] == "zlib+json"
+    assert run(db.document_blobs.count_documents({})) == 0
+
+    loaded = run(server.get_document("inline", server.DOCUMENT_CONTENT_FIELDS))
+    assert loaded["extracted_text"] == "Hemoglobin 13.5 g/dL"
+    assert loaded["analysis"] == {"analysis": "Diagnosed: Migraine"}
+    assert loaded["recommendations"] == {"ai_recommendations": "Rest"}
+
+
+def test_large_fields_round_trip_through_blob_chunks(server, db, small_blobs):
+    text = report_text(20000)
+    document = store(server, "blob", text)
+    descriptor = document["content"]["extracted_text"]
+    assert descriptor["location"] == "blob"
+    assert descriptor["chunks"] > 1
+    assert descriptor["size"] == len(text.encode("utf-8"))
+    assert run(db.document_blobs.count_documents({"document_id": "blob", "field": "extracted_text"})) == descriptor["chunks"]
+
+    metadata = run(server.get_document("blob"))
+    assert "extracted_text" not in metadata
+    assert "data" not in metadata["content"]["analysis"]
+    assert run(server.get_document("blob", ("extracted_text",)))["extracted_text"] == text
+
+
+def test_legacy_uncompressed_records_still_load(server, db):
+    run(db.medical_documents.insert_one({
+        "document_id": "legacy", "filename": "old.pdf", "extracted_text": "Old report", "analysis": {"analysis": "Old"}
+    }))
+    loaded = run(server.get_document("legacy", ("extracted_text", "analysis")))
+    assert loaded["extracted_text"] == "Old report"
+    assert loaded["analysis"] == {"analysis": "Old"}
+    assert "extracted_text" not in run(server.get_document("legacy"))
+
+
+@pytest.fixture
+def client(server, db, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "s3cret")
+    return TestClient(server.app, headers={"X-Admin-Token": "s3cret"})
+
+
+def get_range(client, document_id: str, header: str):
+    return client.get(f"/api/documents/{document_id}/text", headers={"Range": header})
+
+
+def test_ranges_crossing_blob_chunks(server, db, small_blobs, client):
+    text = report_text(20000)
+    raw = text.encode("utf-8")
+    store(server, "ranged", text)
+    size = len(raw)
+    for start, end in [(0, 0), (0, 99), (250, 1300), (4000, 12000), (size - 10, size - 1), (0, size - 1)]:
+        response = get_range(client, "ranged", f"bytes={start}-{end}")
+        assert response.status_code == 206
+        assert response.headers["content-range"] == f"bytes {start}-{end}/{size}"
+        assert response.content == raw[start:end + 1]
+
+    open_ended = get_range(client, "ranged", f"bytes={size - 500}-")
+    assert open_ended.content == raw[size - 500:]
+    past_end = get_range(client, "ranged", f"bytes=100-{size + 1000}")
+    assert past_end.headers["content-range"] == f"bytes 100-{size - 1}/{size}"
+    assert past_end.content == raw[100:]
+
+
+def test_suffix_and_unsatisfiable_ranges(server, db, client):
+    raw = "Hemoglobin 13.5 g/dL".encode("utf-8")
+    store(server, "short", raw.decode("utf-8"))
+    assert get_range(client, "short", "bytes=-4").content == raw[-4:]
+    assert get_range(client, "short", "bytes=-1000").content == raw
+
+    for header in ("bytes=-0", f"bytes={len(raw)}-", "bytes=5-2"):
+        response = get_range(client, "short", header)
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(raw)}"
+    assert get_range(client, "short", "bytes=1-2,4-5").status_code == 416
+
+
+def test_empty_text(server, db, client):
+    store(server, "empty", "")
+    response = client.get("/api/documents/empty/text")
+    assert response.status_code == 200
+    assert response.text == ""
+    for header in ("bytes=0-", "bytes=-5", "bytes=-0"):
+        assert get_range(client, "empty", header).status_code == 416
+
+
+def test_text_requires_admin_token(server, db, client):
+    store(server, "private", "Hemoglobin 13.5 g/dL")
+    assert client.get("/api/documents/private/text", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert TestClient(server.app).get("/api/documents/private/text").status_code == 403
+
+
+def test_ranges_on_legacy_records(server, db, client):
+    run(db.medical_documents.insert_one({"document_id": "legacy", "extracted_text": "Old report text"}))
+    response = get_range(client, "legacy", "bytes=4-9")
+    assert response.status_code == 206
+    assert response.content == b"report"
+    assert response.headers["content-range"] == "bytes 4-9/15"
+
+
+def test_search_backfill_indexes_documents_missing_from_search(server, db, monkeypatch):
+    monkeypatch.setattr(server, "SEARCH_BACKFILL_BATCH_SIZE", 2)
+    run(db.medical_documents.insert_one({
+        "document_id": "legacy", "filename": "old.pdf", "extracted_text": "Patient takes Metformin for diabetes",
+        "analysis": {"analysis": "Type 2 diabetes"}
+    }))
+    store(server, "compressed", "Migraine with aura, prescribed ibuprofen")
+    store(server, "indexed", "Already searchable")
+    run(db.document_search.insert_one({"document_id": "indexed", "body": "already searchable"}))
+    run(db.medical_documents.insert_one({"document_id": "empty", "filename": "blank.png"}))
+
+    assert run(server.backfill_search_index()) == 3
+    entries = {entry["document_id"]: entry for entry in run(db.document_search.find({}, {"_id": 0}).to_list(None))}
+    assert set(entries) == {"legacy", "compressed", "indexed", "empty"}
+    assert "metformin" in entries["legacy"]["body"]
+    assert "aura" in entries["compressed"]["body"]
+    assert entries["indexed"] == {"document_id": "indexed", "body": "already searchable"}
+    assert run(db.medical_documents.count_documents({"search_indexed_at": None})) == 0
+
+    assert run(server.backfill_search_index()) == 0
+
+
+def test_search_backfill_skips_marked_documents(server, db, monkeypatch):
+    store(server, "marked", "Migraine with aura")
+    run(server.index_document_for_search("marked", "marked.pdf", None, "Migraine with aura", {}))
+    store(server, "broken", "Unreadable")
+    assert run(db.medical_documents.find_one({"document_id": "marked"}))["search_indexed_at"] is not None
+
+    loaded = []
+
+    async def failing_get_document(document_id, include=()):
+        loaded.append(document_id)
+        raise RuntimeError("corrupt chunk")
+
+    monkeypatch.setattr(server, "get_document", failing_get_document)
+    assert run(server.backfill_search_index()) == 0
+    assert loaded == ["broken"]
+    # A document that failed to index stays unmarked so the next start retries it
+    assert run(db.medical_documents.find_one({"document_id": "broken"})).get("search_indexed_at") is None
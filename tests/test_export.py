@@ -0,0 +1,112 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.conftest import run
+
+HEADERS = {"X-Admin-Token": "s3cret"}
+
+
+@pytest.fixture
+def client(server, db, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "s3cret")
+    return TestClient(server.app)
+
+
+def export_lines(client, url: str) -> list:
+    response = client.get(url, headers=HEADERS)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def cursor(state: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state).encode("utf-8")).decode("ascii")
+
+
+def test_content_fields_export_from_legacy_and_compressed_documents(server, db, client):
+    run(db.medical_documents.insert_one({"document_id": "legacy", "extracted_text": "Old report", "analysis": {"analysis": "Old"}}))
+    run(server.store_medical_document(
+        {"document_id": "new", "filename": "new.pdf"},
+        {"extracted_text": "New report", "analysis": {"analysis": "New"}, "recommendations": {}}
+    ))
+    lines = export_lines(client, "/api/admin/export/documents?fields=document_id,extracted_text,analysis")
+    rows = [line for line in lines if "document_id" in line]
+    assert rows == [
+        {"document_id": "legacy", "extracted_text": "Old report", "analysis": {"analysis": "Old"}},
+        {"document_id": "new", "extracted_text": "New report", "analysis": {"analysis": "New"}},
+    ]
+    assert lines[-1] == {"_complete": True}
+
+
+def test_resuming_from_a_checkpoint(server, db, client):
+    run(db.diagnosis_sessions.insert_many([{"session_id": f"s{i}"} for i in range(5)]))
+    first = export_lines(client, "/api/admin/export/sessions?batch_size=2&fields=session_id")
+    assert [line["session_id"] for line in first[:2]] == ["s0", "s1"]
+    token = first[2]["_checkpoint"]
+    resumed = export_lines(client, f"/api/admin/export/sessions?cursor={token}")
+    assert [line["session_id"] for line in resumed if "session_id" in line] == ["s2", "s3", "s4"]
+
+
+def test_time_filtered_export_walks_in_time_order(server, db, client):
+    start = datetime(2025, 1, 1)
+    # Inserted out of time order, with a tie, so _id order and time order disagree
+    offsets = {"s0": 3, "s1": 1, "s2": 2, "s3": 1, "s4": 0, "s5": 9}
+    run(db.diagnosis_sessions.insert_many([
+        {"session_id": session_id, "timestamp": start + timedelta(hours=hours)} for session_id, hours in offsets.items()
+    ]))
+    window = f"since={start.isoformat()}&until={(start + timedelta(hours=5)).isoformat()}"
+    lines = export_lines(client, f"/api/admin/export/sessions?batch_size=2&fields=session_id&{window}")
+    assert [line["session_id"] for line in lines if "session_id" in line] == ["s4", "s1", "s3", "s2", "s0"]
+    assert all("timestamp" not in line for line in lines)
+
+    # The first checkpoint falls between the two sessions sharing a timestamp
+    token = lines[2]["_checkpoint"]
+    resumed = export_lines(client, f"/api/admin/export/sessions?cursor={token}")
+    assert [line["session_id"] for line in resumed if "session_id" in line] == ["s3", "s2", "s0"]
+
+
+def test_cursor_batch_size_is_clamped(server, db, client, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_MAX_BATCH_SIZE", 2)
+    run(db.diagnosis_sessions.insert_many([{"session_id": f"s{i}"} for i in range(3)]))
+    token = cursor({"dataset": "sessions", "format": "ndjson", "fields": ["session_id"], "batch_size": 10 ** 9, "after": None})
+    lines = export_lines(client, f"/api/admin/export/sessions?cursor={token}")
+    assert "_checkpoint" in lines[2]
+
+
+@pytest.mark.parametrize("state", [
+    {"dataset": "sessions", "fields": [], "batch_size": 10, "after": None},
+    {"dataset": "sessions", "format": "ndjson", "fields": [], "after": None},
+    {"dataset": "sessions", "format": "xml", "fields": [], "batch_size": 10, "after": None},
+    {"dataset": "sessions", "format": "ndjson", "fields": "session_id", "batch_size": 10, "after": None},
+    {"dataset": "sessions", "format": "ndjson", "fields": [], "batch_size": "many", "after": None},
+    {"dataset": "sessions", "format": "ndjson", "fields": [], "batch_size": 10, "after": "not-an-id"},
+    {"dataset": "sessions", "format": "ndjson", "fields": [], "batch_size": 10, "since": "yesterday"},
+    {"dataset": "sessions", "format": "ndjson", "fields": [], "batch_size": 10, "since": "2025-01-01T00:00:00", "after": "0" * 24},
+    ["not", "a", "dict"],
+])
+def test_malformed_cursors_are_rejected(client, state):
+    response = client.get(f"/api/admin/export/sessions?cursor={cursor(state)}", headers=HEADERS)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("format", ["ndjson", "columnar"])
+def test_batches_are_flushed_at_the_byte_budget(server, db, client, monkeypatch, format):
+    monkeypatch.setattr(server, "EXPORT_MAX_BATCH_BYTES", 2500)
+    for i in range(4):
+        run(server.store_medical_document(
+            {"document_id": f"doc{i}", "filename": f"doc{i}.pdf"},
+            {"extracted_text": "x" * 1000, "analysis": {}, "recommendations": {}}
+        ))
+    lines = export_lines(client, f"/api/admin/export/documents?format={format}&fields=document_id,extracted_text")
+    checkpoints = [line for line in lines if "_checkpoint" in line]
+    assert len(checkpoints) == 2
+    if format == "columnar":
+        assert [batch["rows"] for batch in checkpoints] == [3, 1]
+        assert checkpoints[1]["columns"]["document_id"] == ["doc3"]
+    else:
+        rows = [line["document_id"] for line in lines if "document_id" in line]
+        assert rows == ["doc0", "doc1", "doc2", "doc3"]
+        assert lines[3] == checkpoints[0]
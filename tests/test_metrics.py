@@ -0,0 +1,51 @@
+from fastapi.testclient import TestClient
+
+
+def test_histogram_renders_cumulative_buckets(server, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_REGISTRY", [])
+    histogram = server.Histogram("test_latency_seconds", "Test latency", ("endpoint",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, endpoint="/a")
+
+    assert histogram.render() == [
+        "# HELP test_latency_seconds Test latency",
+        "# TYPE test_latency_seconds histogram",
+        'test_latency_seconds_bucket{endpoint="/a",le="0.1"} 2',
+        'test_latency_seconds_bucket{endpoint="/a",le="1.0"} 3',
+        'test_latency_seconds_bucket{endpoint="/a",le="+Inf"} 4',
+        'test_latency_seconds_sum{endpoint="/a"} 3.65',
+        'test_latency_seconds_count{endpoint="/a"} 4',
+    ]
+    assert histogram.value(endpoint="/a") == 3.65 / 4
+    assert histogram.value(endpoint="/missing") == 0.0
+
+
+def test_requests_are_labelled_by_route_template(server, db):
+    client = TestClient(server.app)
+    labels = {"method": "GET", "endpoint": "/api/session/{session_id}", "status": 404}
+    before = server.HTTP_REQUEST_LATENCY._values.get(server.HTTP_REQUEST_LATENCY._key(labels), [None, 0.0, 0])[2]
+
+    for session_id in ("first", "second"):
+        assert client.get(f"/api/session/{session_id}").status_code == 404
+
+    after = server.HTTP_REQUEST_LATENCY._values[server.HTTP_REQUEST_LATENCY._key(labels)][2]
+    assert after == before + 2
+    assert not any(key[1] == "/api/session/first" for key in server.HTTP_REQUEST_LATENCY._values)
+
+    client.get("/no/such/path")
+    assert server.HTTP_REQUEST_LATENCY._key({"method": "GET", "endpoint": "unmatched", "status": 404}) in server.HTTP_REQUEST_LATENCY._values
+
+
+def test_metrics_endpoint_serves_prometheus_text(server, db):
+    client = TestClient(server.app)
+    client.get("/api/session/anything")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert body.endswith("\n")
+    assert "# TYPE medi_http_request_duration_seconds histogram" in body
+    assert 'medi_http_request_duration_seconds_count{method="GET",endpoint="/api/session/{session_id}",status="404"}' in body
+    assert "# TYPE medi_http_requests_in_flight gauge" in body
+    assert "# TYPE medi_llm_tokens_total counter" in body
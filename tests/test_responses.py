@@ -0,0 +1,57 @@
+import warnings
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.conftest import run
+
+ADMIN_HEADERS = {"X-Admin-Token": "s3cret"}
+
+
+@pytest.fixture
+def client(server, db, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "s3cret")
+    return TestClient(server.app)
+
+
+def get_without_deprecations(client, method: str, url: str, **kwargs):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        return client.request(method, url, **kwargs)
+
+
+def test_dict_endpoints_serialize_natively(server, client):
+    conditions = get_without_deprecations(client, "GET", "/api/conditions")
+    assert conditions.status_code == 200
+    assert conditions.headers["content-type"] == "application/json"
+    assert [c["name"] for c in conditions.json()] == [c["name"] for c in server.MEDICAL_CONDITIONS]
+
+    stats = get_without_deprecations(client, "GET", "/api/diagnosis-stats")
+    assert stats.json()["max_turns"] == server.MAX_DIAGNOSIS_TURNS
+
+    medicine = get_without_deprecations(client, "POST", "/api/get-medicine-suggestions", json={"disease_name": "Migraine"})
+    assert medicine.json()["disease"] == "Migraine"
+
+
+def test_document_metadata_dates_serialize_as_iso(server, client):
+    uploaded_at = datetime(2025, 3, 1, 12, 30)
+    run(server.store_medical_document(
+        {"document_id": "doc-1", "filename": "report.pdf", "file_type": "application/pdf", "uploaded_at": uploaded_at},
+        {"extracted_text": "Hemoglobin 13.5", "analysis": {"analysis": "Normal"}, "recommendations": {}}
+    ))
+    listed = get_without_deprecations(client, "GET", "/api/documents", headers=ADMIN_HEADERS)
+    assert listed.json()[0]["uploaded_at"] == "2025-03-01T12:30:00"
+
+    document = get_without_deprecations(client, "GET", "/api/documents/doc-1?include=analysis", headers=ADMIN_HEADERS)
+    assert document.json()["analysis"] == {"analysis": "Normal"}
+
+
+def test_document_reads_require_admin_token(server, client):
+    run(server.store_medical_document(
+        {"document_id": "doc-1", "filename": "report.pdf", "file_type": "application/pdf"},
+        {"extracted_text": "Hemoglobin 13.5", "analysis": {}, "recommendations": {}}
+    ))
+    for url in ("/api/documents", "/api/documents/doc-1", "/api/documents/search?q=hemoglobin"):
+        assert client.get(url).status_code == 403
+        assert client.get(url, headers={"X-Admin-Token": "wrong"}).status_code == 403
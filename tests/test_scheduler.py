@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.conftest import run
+
+
+def scheduler(server, capacity, reserved=None):
+    return server.PriorityScheduler("test", capacity, {"interactive": 4, "bulk": 1}, reserved or {})
+
+
+async def hold(server, s, priority, granted, release=None):
+    server.request_priority.set(priority)
+    async with s.slot():
+        granted.append(priority)
+        if release is not None:
+            await release.wait()
+        else:
+            await asyncio.sleep(0.001)
+
+
+def test_weighted_share_while_both_classes_are_queued(server):
+    async def main():
+        s = scheduler(server, 1)
+        granted = []
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(hold(server, s, "bulk", [], release))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(hold(server, s, "bulk", granted)) for _ in range(10)]
+        waiters += [asyncio.ensure_future(hold(server, s, "interactive", granted)) for _ in range(10)]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        return granted
+
+    granted = run(main())
+    assert len(granted) == 20
+    # interactive:bulk weights of 4:1 give 8 of the first 10 slots to interactive work
+    assert granted[:10].count("interactive") == 8
+    assert granted[10:].count("bulk") == 8
+
+
+def test_bulk_backlog_never_takes_reserved_slots(server):
+    async def main():
+        s = scheduler(server, 3, {"interactive": 1})
+        release = asyncio.Event()
+        granted = []
+        bulk = [asyncio.ensure_future(hold(server, s, "bulk", granted, release)) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        assert s.active == {"interactive": 0, "bulk": 2}
+        assert len(s.queues["bulk"]) == 8
+
+        interactive = asyncio.ensure_future(hold(server, s, "interactive", granted, release))
+        await asyncio.sleep(0.01)
+        assert s.active == {"interactive": 1, "bulk": 2}
+        release.set()
+        await asyncio.gather(*bulk, interactive)
+        return s
+
+    s = run(main())
+    assert s.active == {"interactive": 0, "bulk": 0}
+
+
+def test_reservation_is_capped_below_capacity(server):
+    s = scheduler(server, 2, {"interactive": 5})
+    assert s.reserved == {"interactive": 1, "bulk": 0}
+
+
+def test_cancelled_and_timed_out_waiters_do_not_leak_slots(server):
+    async def main():
+        s = scheduler(server, 1)
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(hold(server, s, "interactive", [], release))
+        await asyncio.sleep(0)
+
+        cancelled = asyncio.ensure_future(hold(server, s, "bulk", []))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+        async def timed_out():
+            server.request_deadline.set(server.time.monotonic() + 0.01)
+            await hold(server, s, "bulk", [])
+
+        with pytest.raises(server.DeadlineExceeded):
+            await timed_out()
+
+        release.set()
+        await holder
+        assert s.active == {"interactive": 0, "bulk": 0}
+        assert all(not queue or queue[0][1].done() for queue in s.queues.values())
+
+        granted = []
+        await asyncio.wait_for(hold(server, s, "bulk", granted), 1)
+        return granted
+
+    assert run(main()) == ["bulk"]
+
+
+def test_slot_granted_as_the_wait_is_cancelled_is_released(server):
+    async def main():
+        s = scheduler(server, 1)
+        server.request_priority.set("interactive")
+        holding = s.slot()
+        await holding.__aenter__()
+
+        waiter = asyncio.ensure_future(hold(server, s, "bulk", []))
+        await asyncio.sleep(0)
+        # Releasing hands the slot to the waiter; cancel it before it gets to run
+        await holding.__aexit__(None, None, None)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return s
+
+    s = run(main())
+    assert s.active == {"interactive": 0, "bulk": 0}
+
+
+def test_batch_suggestion_llm_calls_run_as_interactive(server, db, monkeypatch):
+    seen = []
+
+    async def spy(system_message, text, purpose, session_id=None, max_tokens=None):
+        seen.append((purpose, server.request_priority.get()))
+        return "{}"
+
+    monkeypatch.setattr(server, "send_llm_message", spy)
+    client = TestClient(server.app)
+    response = client.post("/api/get-batch-suggestions", json={"conditions": ["zeta fever"], "include": ["medicines"]})
+    assert response.status_code == 200
+    assert seen == [("batch_suggestions", "interactive")]
+
+
+def test_diagnosis_llm_calls_run_as_interactive(server, db, monkeypatch):
+    seen = []
+
+    async def spy(system_message, text, purpose, session_id=None, max_tokens=None):
+        seen.append((purpose, server.request_priority.get()))
+        return '{"type": "question", "question": "Any fever?", "conditions": []}'
+
+    monkeypatch.setattr(server, "send_llm_message", spy)
+    response = TestClient(server.app).post("/api/start-diagnosis")
+    assert response.status_code == 200
+    assert [priority for _, priority in seen] == ["interactive"]
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+
+from tests.conftest import run
+
+
+def test_backfill_gives_legacy_sessions_lifecycle_fields(server, db, monkeypatch):
+    monkeypatch.setattr(server, "SESSION_ARCHIVE_BATCH_SIZE", 2)
+    started = datetime(2024, 1, 1)
+    legacy = [
+        {"session_id": f"open-{i}", "user_responses": [], "timestamp": started} for i in range(3)
+    ] + [
+        {"session_id": "done", "final_diagnosis": "Migraine", "timestamp": started, "last_activity": started + timedelta(minutes=5)},
+        {"session_id": "current", "expires_at": started + timedelta(days=2), "completed_at": None},
+    ]
+    run(db.diagnosis_sessions.insert_many(legacy))
+
+    assert run(server.backfill_session_lifecycle()) == 4
+    sessions = {doc["session_id"]: doc for doc in run(db.diagnosis_sessions.find({}).to_list(None))}
+    ttl = timedelta(seconds=server.SESSION_IDLE_TTL_SECONDS)
+    assert all(sessions[f"open-{i}"]["expires_at"] == started + ttl for i in range(3))
+    assert sessions["done"]["completed_at"] == started + timedelta(minutes=5)
+    assert sessions["done"]["expires_at"] is None
+    assert sessions["current"]["expires_at"] == started + timedelta(days=2)
+
+    # Nothing left to upgrade, and the compactor now archives the old completed session
+    assert run(server.backfill_session_lifecycle()) == 0
+    assert run(server.archive_completed_sessions()) == 1
+    assert run(db.diagnosis_sessions_archive.find_one({"session_id": "done"}))["final_diagnosis"] == "Migraine"
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import pytest
+
+from tests.conftest import run
+
+
+@pytest.fixture
+def warmup_state(server, monkeypatch):
+    state = {"ready": False, "steps": {}}
+    monkeypatch.setattr(server, "warmup_state", state)
+    monkeypatch.setattr(server, "WARMUP_RETRY_INITIAL_SECONDS", 0.0)
+    return state
+
+
+def test_required_steps_retry_until_mongo_is_reachable(server, db, warmup_state, monkeypatch):
+    calls = []
+
+    async def command(name):
+        calls.append(name)
+        if len(calls) < 3:
+            raise ConnectionError("connection refused")
+        return {"ok": 1}
+
+    monkeypatch.setattr(server, "client", SimpleNamespace(admin=SimpleNamespace(command=command)))
+    run(server.run_warmup())
+    assert warmup_state["ready"]
+    assert warmup_state["steps"]["mongo_connect"] == {"status": "ok", "seconds": pytest.approx(0, abs=1), "attempts": 3}
+    assert warmup_state["steps"]["mongo_indexes"]["attempts"] == 1
+
+
+def test_optional_step_failure_does_not_block_readiness(server, db, warmup_state, monkeypatch):
+    async def command(name):
+        return {"ok": 1}
+
+    async def broken_llm_client():
+        raise RuntimeError("provider SDK missing")
+
+    monkeypatch.setattr(server, "client", SimpleNamespace(admin=SimpleNamespace(command=command)))
+    monkeypatch.setattr(server, "warm_llm_client", broken_llm_client)
+    run(server.run_warmup())
+    assert warmup_state["ready"]
+    assert warmup_state["steps"]["llm_client"]["status"] == "failed"